@@ -1,95 +1,232 @@
+import asyncio
 import json
+import logging
 import os
-import pandas as pd
+from collections import Counter
 from datetime import datetime
 from products import load_products
+import cluster
+import fileio
+import metrics
 
 ANALYTICS_FILE = "analytics.json"
 
+# Events are appended as JSON lines to segment files in EVENTS_DIR. A new
+# segment starts every day and whenever the current one grows past
+# MAX_SEGMENT_BYTES. log_search/log_order only buffer in memory; the
+# background task started by start() flushes the buffer every FLUSH_EVERY
+# events or FLUSH_INTERVAL seconds, and stop() flushes what is left.
+EVENTS_DIR = "analytics_events"
+LEGACY_SEGMENT = "events-legacy.jsonl"
+LEGACY_MARKER = ".legacy_imported"
+MAX_SEGMENT_BYTES = 5 * 1024 * 1024
+FLUSH_EVERY = 100
+FLUSH_INTERVAL = 5
+
+_buffer = []
+_flush_needed = None
+_flush_lock = None
+_flush_task = None
+
+def _timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _segment_names():
+    if not os.path.isdir(EVENTS_DIR):
+        return []
+    return sorted(name for name in os.listdir(EVENTS_DIR)
+                  if name.startswith("events-") and name.endswith(".jsonl") and name != LEGACY_SEGMENT)
+
+def _current_segment():
+    # events-YYYY-MM-DD-NNN.jsonl, NNN grows when a segment hits the size limit
+    prefix = f"events-{datetime.now().strftime('%Y-%m-%d')}-"
+    todays = [name for name in _segment_names() if name.startswith(prefix)]
+    if todays:
+        path = os.path.join(EVENTS_DIR, todays[-1])
+        if os.path.getsize(path) < MAX_SEGMENT_BYTES:
+            return path
+        number = int(todays[-1][len(prefix):-len(".jsonl")]) + 1
+    else:
+        number = 0
+    return os.path.join(EVENTS_DIR, f"{prefix}{number:03d}.jsonl")
+
+def _append_events(events, path=None):
+    if not events:
+        return
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    lines = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+    with open(path or _current_segment(), "a", encoding="utf-8") as f:
+        f.write(lines)
+
+def _queue(events):
+    _buffer.extend(events)
+    if len(_buffer) >= FLUSH_EVERY and _flush_needed is not None:
+        _flush_needed.set()
+
+def segment_paths():
+    """Paths of all event segments in order, the legacy import first."""
+    names = _segment_names()
+    if os.path.exists(os.path.join(EVENTS_DIR, LEGACY_SEGMENT)):
+        names.insert(0, LEGACY_SEGMENT)
+    return [os.path.join(EVENTS_DIR, name) for name in names]
+
+def iter_events():
+    """Yields every stored event (legacy import first), then unflushed ones."""
+    for path in segment_paths():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line after a crash
+                    continue
+    yield from list(_buffer)
+
 def load_analytics():
-    if not os.path.exists(ANALYTICS_FILE):
-        return {"searches": [], "orders": []}
+    data = {"searches": [], "orders": []}
+    for event in iter_events():
+        if event.get("type") == "search":
+            data["searches"].append({"query": event["query"], "timestamp": event["timestamp"]})
+        elif event.get("type") == "order":
+            data["orders"].append({"product_id": event["product_id"], "timestamp": event["timestamp"]})
+    return data
+
+@metrics.timed("analytics")
+def log_search(query):
+    _queue([{"type": "search", "query": query, "timestamp": _timestamp()}])
+
+@metrics.timed("analytics")
+def log_order(items):
+    # items: {product_id: quantity}, one event per distinct book
+    timestamp = _timestamp()
+    _queue([{"type": "order", "product_id": pid, "quantity": quantity, "timestamp": timestamp}
+            for pid, quantity in items.items()])
+
+@metrics.timed("analytics")
+def flush():
+    # Synchronous flush, for scripts and tests outside the event loop
+    global _buffer
+    batch, _buffer = _buffer, []
+    _append_events(batch)
+
+async def flush_async():
+    global _buffer
+    if _flush_lock is None:
+        # start() was not called, nothing runs in the background
+        flush()
+        return
+    async with _flush_lock:
+        batch, _buffer = _buffer, []
+        if not batch:
+            return
+        try:
+            # Workers append to the same segment (cluster.py)
+            async with cluster.lock():
+                await fileio.run(_append_events, batch)
+        except Exception:
+            logging.exception("Analytics flush failed, keeping %d events in memory", len(batch))
+            _buffer = batch + _buffer
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_needed.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_needed.clear()
+        await flush_async()
+
+def import_legacy_json():
+    """One-time import of the old analytics.json into the event log."""
+    marker = os.path.join(EVENTS_DIR, LEGACY_MARKER)
+    if os.path.exists(marker) or not os.path.exists(ANALYTICS_FILE):
+        return 0
     try:
         with open(ANALYTICS_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
-            # Ensure keys exist
-            if "searches" not in data: data["searches"] = []
-            if "orders" not in data: data["orders"] = []
-            return data
     except:
-        return {"searches": [], "orders": []}
+        data = {}
+    events = []
+    for entry in data.get("searches", []):
+        events.append({"type": "search", "query": entry["query"], "timestamp": entry["timestamp"]})
+    for entry in data.get("orders", []):
+        events.append({"type": "order", "product_id": entry["product_id"], "timestamp": entry["timestamp"]})
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    legacy_path = os.path.join(EVENTS_DIR, LEGACY_SEGMENT)
+    # Rewrite (not append) so an import interrupted before the marker is safe to redo
+    with open(legacy_path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(_timestamp())
+    return len(events)
 
-def save_analytics(data):
-    with open(ANALYTICS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+async def start():
+    global _flush_needed, _flush_lock, _flush_task
+    imported = await fileio.run(import_legacy_json)
+    if imported:
+        logging.info("Imported %d analytics events from %s", imported, ANALYTICS_FILE)
+    _flush_needed = asyncio.Event()
+    _flush_lock = asyncio.Lock()
+    _flush_task = asyncio.create_task(_flush_loop())
+    if len(_buffer) >= FLUSH_EVERY:
+        _flush_needed.set()
+
+async def stop():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush_async()
+
+def _write_sheet(workbook, title, header, rows):
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(list(row))
+
+@metrics.timed("analytics")
+def export_stats(filename="statistics.xlsx"):
+    # openpyxl is only needed here, keep it out of the bot's import path
+    from openpyxl import Workbook
 
-def log_search(query):
-    data = load_analytics()
-    entry = {
-        "query": query,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    data["searches"].append(entry)
-    save_analytics(data)
-
-def log_order(product_ids):
-    data = load_analytics()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for pid in product_ids:
-        entry = {
-            "product_id": pid,
-            "timestamp": timestamp
-        }
-        data["orders"].append(entry)
-    save_analytics(data)
-
-def export_stats():
-    data = load_analytics()
     products = load_products()
-    
-    # 1. Prepare Searches DataFrame
-    if data["searches"]:
-        df_searches = pd.DataFrame(data["searches"])
-        # Group by query to count popularity
-        search_counts = df_searches['query'].value_counts().reset_index()
-        search_counts.columns = ['Qidiruv So\'zi', 'Soni']
-    else:
-        search_counts = pd.DataFrame(columns=['Qidiruv So\'zi', 'Soni'])
-        
-    # 2. Prepare Orders DataFrame
-    if data["orders"]:
-        orders_list = []
-        for order in data["orders"]:
-            pid = str(order["product_id"])
-            p_name = products[pid]['name'] if pid in products else f"Unknown ({pid})"
-            category = products[pid].get('category', 'Boshqa') if pid in products else "Noma'lum"
-            orders_list.append({
-                "product_name": p_name,
-                "category": category,
-                "timestamp": order["timestamp"]
-            })
-        
-        df_orders = pd.DataFrame(orders_list)
-        # Group by product to count sales
-        sales_counts = df_orders['product_name'].value_counts().reset_index()
-        sales_counts.columns = ['Kitob Nomi', 'Sotilgan Soni']
-        
-        # Group by category
-        cat_counts = df_orders['category'].value_counts().reset_index()
-        cat_counts.columns = ['Kategoriya', 'Sotilgan Soni']
-    else:
-        sales_counts = pd.DataFrame(columns=['Kitob Nomi', 'Sotilgan Soni'])
-        cat_counts = pd.DataFrame(columns=['Kategoriya', 'Sotilgan Soni'])
-
-    # Write to Excel
-    filename = "statistics.xlsx"
-    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-        sales_counts.to_excel(writer, sheet_name="Top Kitoblar", index=False)
-        cat_counts.to_excel(writer, sheet_name="Kategoriyalar", index=False)
-        search_counts.to_excel(writer, sheet_name="Qidiruvlar", index=False)
-        
-        # Raw data (optional)
-        # if data["searches"]:
-        #     df_searches.to_excel(writer, sheet_name="Qidiruv Tarixi", index=False)
-        
+    search_counts = Counter()
+    sales_counts = Counter()
+    cat_counts = Counter()
+
+    # Single streaming pass over the event log, only counters stay in memory
+    for event in iter_events():
+        if event.get("type") == "search":
+            search_counts[event["query"]] += 1
+        elif event.get("type") == "order":
+            pid = event["product_id"]
+            # Events from before quantities stood for one copy each
+            quantity = event.get("quantity", 1)
+            product = products.get(int(pid))
+            if product:
+                sales_counts[product['name']] += quantity
+                cat_counts[product.get('category', 'Boshqa')] += quantity
+            else:
+                sales_counts[f"Unknown ({pid})"] += quantity
+                cat_counts["Noma'lum"] += quantity
+
+    # Write-only mode streams rows to disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    _write_sheet(workbook, "Top Kitoblar", ['Kitob Nomi', 'Sotilgan Soni'], sales_counts.most_common())
+    _write_sheet(workbook, "Kategoriyalar", ['Kategoriya', 'Sotilgan Soni'], cat_counts.most_common())
+    _write_sheet(workbook, "Qidiruvlar", ['Qidiruv So\'zi', 'Soni'], search_counts.most_common())
+    workbook.save(filename)
+
     return filename
+
+if __name__ == "__main__":
+    count = import_legacy_json()
+    print(f"Imported {count} events into {EVENTS_DIR}/")
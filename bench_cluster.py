@@ -0,0 +1,242 @@
+"""Multi-worker check: no cart or order update is lost.
+
+Usage: python bench_cluster.py [workers] [users] [taps]
+
+Runs `python main.py` with BOT_WORKERS=workers (the supervisor and its
+worker processes) against the fake Bot API from fake_telegram.py, in a
+temporary data directory. Every simulated user registers, opens a book and
+presses "Savatga qo'shish" `taps` times at once; every other user then
+checks out. Meanwhile the admin imports a CSV that changes prices and adds
+books. Once every worker shows the new catalog, the bot is stopped with
+SIGTERM and the stores are read back:
+
+- every tap is in a cart or an order;
+- every order is in the ledger and the analytics log;
+- every user is in the registry.
+"""
+import asyncio
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+API_PORT = 18085
+WORKER_BASE_PORT = 18300
+STEP_TIMEOUT = 30
+# Every worker imports aiogram and loads the stores; on a single core that
+# adds up to well over STEP_TIMEOUT
+STARTUP_TIMEOUT = 180
+QUIET = 0.05
+
+# Read by config.py, here and in the bot processes
+os.environ["METRICS_PORT"] = "0"
+os.environ["THROTTLE_LIMITS"] = "0"
+os.environ["WORKER_BASE_PORT"] = str(WORKER_BASE_PORT)
+os.environ["BOT_API_URL"] = f"http://127.0.0.1:{API_PORT}"
+
+from bench_load import ADMIN_ID, make_data_dir
+from fake_telegram import FakeTelegramServer
+
+class ScriptError(Exception):
+    pass
+
+class Client:
+    """Drives users through the fake API. The bot runs in other processes,
+    so a step is done when the bot has answered and then gone quiet."""
+
+    def __init__(self, api):
+        self.api = api
+
+    async def _wait(self, condition, what, timeout=STEP_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise ScriptError(f"timed out waiting for {what}")
+            await asyncio.sleep(0.01)
+
+    async def settle(self, user_id, before):
+        await self._wait(lambda: self.api.activity[user_id] > before, f"a reply to {user_id}")
+        while True:
+            seen = self.api.activity[user_id]
+            await asyncio.sleep(QUIET)
+            if self.api.activity[user_id] == seen:
+                return
+
+    async def send(self, user_id, update):
+        before = self.api.activity[user_id]
+        self.api.push_update(update)
+        await self.settle(user_id, before)
+
+    async def text(self, user_id, text):
+        await self.send(user_id, self.api.message_update(user_id, text=text))
+
+    async def button(self, user_id, prefix, rng=None):
+        # The message with it may still be on its way
+        await self._wait(lambda: self.api.find_button(user_id, prefix)[1], f"a {prefix!r} button for {user_id}")
+        message, data = self.api.find_button(user_id, prefix)
+        return message, (rng.choice(data) if rng else data[0])
+
+    async def press(self, user_id, prefix, rng=None):
+        message, data = await self.button(user_id, prefix, rng)
+        await self.send(user_id, self.api.callback_update(user_id, data, message))
+        return data
+
+    async def taps(self, user_id, prefix, count):
+        # All at once, like an impatient user
+        message, data = await self.button(user_id, prefix)
+        before = self.api.activity[user_id]
+        updates = [self.api.callback_update(user_id, data, message) for _ in range(count)]
+        for update in updates:
+            self.api.push_update(update)
+        ids = [update["callback_query"]["id"] for update in updates]
+        await self._wait(lambda: all(i in self.api.answered for i in ids), f"{count} answers to {user_id}")
+        await self.settle(user_id, before)
+        return int(data.rsplit("_", 1)[1])
+
+    def caption(self, user_id):
+        message = self.api.last_message(user_id) or {}
+        return message.get("caption") or message.get("text") or ""
+
+async def customer(client, user_id, taps, checkout, rng, expected):
+    await client.text(user_id, "/start")
+    await client.text(user_id, "📚 Kitoblar")
+    await client.press(user_id, "cat_", rng)
+    await client.press(user_id, "prod_", rng)
+    product_id = await client.taps(user_id, "add_cart_", taps)
+    expected[user_id] = (product_id, checkout)
+    if checkout:
+        await client.text(user_id, "🛒 Savat")
+        await client.press(user_id, "checkout")
+        await client.text(user_id, f"+99890{user_id % 10000000:07d}")
+        await client.text(user_id, "Toshkent, Chilonzor tumani, 1-uy")
+        await client.press(user_id, "ship_")
+        await client.send(user_id, client.api.message_update(user_id, photo_file_id=f"receipt-{user_id}"))
+
+async def admin_import(client, api, new_prices, new_names):
+    rows = ["id,name,category,price,description,image"]
+    for product_id, price in new_prices.items():
+        rows.append(f"{product_id},Arzonlashgan {product_id},Aksiya,{price},,")
+    for name in new_names:
+        rows.append(f",{name},Yangi,45000,,")
+    await client.text(ADMIN_ID, "/import")
+    before = api.activity[ADMIN_ID]
+    api.push_update(api.document_update(ADMIN_ID, "import.csv", "\n".join(rows).encode()))
+    await client._wait(lambda: "Import tugadi" in client.caption(ADMIN_ID), "the import report")
+    await client.settle(ADMIN_ID, before)
+
+def check(results, name, ok, detail=""):
+    results.append(ok)
+    print(f"{'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail and not ok else ''}")
+
+def verify(workers, users, taps, expected, n_books, new_prices, new_names, admin_texts):
+    # The bot has stopped; read its stores from the data directory
+    import analytics
+    import cart_db
+    import orders_db
+    import products
+    import users_db
+
+    results = []
+    check(results, "every script finished", len(expected) == users, f"{users - len(expected)} failed")
+
+    orders = orders_db.get_orders_between("0000", "9999")
+    by_user = {order["user_id"]: order for order in orders}
+    checkouts = {uid: pid for uid, (pid, checkout) in expected.items() if checkout}
+    check(results, f"{len(checkouts)} orders in the ledger", len(orders) == len(checkouts) == len(by_user),
+          f"{len(orders)} orders from {len(by_user)} users")
+    wrong = [uid for uid, pid in checkouts.items()
+             if [(item["product_id"], item["quantity"]) for item in by_user.get(uid, {}).get("items", [])] != [(pid, taps)]]
+    check(results, f"every order has {taps} copies", not wrong, f"users {wrong[:5]}")
+
+    carts = cart_db.load_carts()
+    wrong = [uid for uid, (pid, checkout) in expected.items()
+             if carts.get(str(uid), {}) != ({} if checkout else {pid: taps})]
+    check(results, f"every open cart has {taps} copies, checked out carts are empty", not wrong,
+          f"users {wrong[:5]}: {[carts.get(str(uid)) for uid in wrong[:5]]}")
+
+    sold = sum(event.get("quantity", 1) for event in analytics.iter_events() if event.get("type") == "order")
+    check(results, "analytics has every sold copy", sold == len(checkouts) * taps, f"{sold} != {len(checkouts) * taps}")
+
+    registered = set(users_db.load_users())
+    missing = [uid for uid in expected if uid not in registered]
+    check(results, "every user is registered", not missing, f"{len(missing)} missing")
+
+    catalog = products.load_products()
+    check(results, "catalog has the import", all(catalog[pid]["price"] == price for pid, price in new_prices.items())
+          and sorted(p["name"] for p in catalog.values() if p["category"] == "Yangi") == sorted(new_names)
+          and len(catalog) == n_books + len(new_names), f"{len(catalog)} books")
+
+    check(results, "one start and one stop notice", admin_texts.count("Bot ishga tushdi") == 1
+          and admin_texts.count("Bot to'xtadi") == 1, str([t for t in admin_texts if t.startswith("Bot")]))
+    return all(results)
+
+async def run(workers, users, taps, n_books):
+    data_dir, _ = make_data_dir(n_books)
+    os.chdir(data_dir)
+    api = FakeTelegramServer(port=API_PORT)
+    await api.start()
+    client = Client(api)
+    log = open(os.path.join(data_dir, "bot.log"), "w")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    bot = subprocess.Popen([sys.executable, script], env=dict(os.environ, BOT_WORKERS=str(workers)),
+                           stdout=log, stderr=subprocess.STDOUT)
+    rng = random.Random(7)
+    expected = {}
+    new_prices = {pid: 700000 + pid for pid in range(1, 21)}
+    new_names = [f"Yangi kitob {i}" for i in range(5)]
+    user_ids = [200000 + i for i in range(users)]
+    try:
+        await client._wait(lambda: api.outbox.get(ADMIN_ID), "the start notice", STARTUP_TIMEOUT)
+        start = time.perf_counter()
+
+        async def run_user(i, user_id):
+            try:
+                await customer(client, user_id, taps, i % 2 == 0, random.Random(i), expected)
+            except ScriptError as e:
+                print(f"user {user_id}: {e}")
+
+        await asyncio.gather(admin_import(client, api, new_prices, new_names),
+                             *(run_user(i, user_id) for i, user_id in enumerate(user_ids)))
+        elapsed = time.perf_counter() - start
+        print(f"{workers} workers, {users} users x {taps} taps: {sum(api.method_counts.values())} API calls in {elapsed:.2f} s")
+
+        # Every worker serves the imported catalog
+        stale = []
+        for worker in range(workers):
+            user_id = next(uid for uid in user_ids if uid % workers == worker)
+            await client.text(user_id, f"/start book_{rng.choice(list(new_prices))}")
+            if "Arzonlashgan" not in client.caption(user_id):
+                stale.append(worker)
+            await client.text(user_id, f"/start book_{n_books + len(new_names)}")
+            if "Yangi kitob" not in client.caption(user_id):
+                stale.append(worker)
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            # In a thread: the fake API on this loop serves the goodbye messages
+            await asyncio.to_thread(bot.wait, 120)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await api.stop()
+        log.close()
+
+    print(f"{'ok  ' if not stale else 'FAIL'} every worker shows the imported catalog{'' if not stale else f': {stale}'}")
+    admin_texts = [message.get("text", "") for message in api.outbox.get(ADMIN_ID, [])]
+    ok = verify(workers, users, taps, expected, n_books, new_prices, new_names, admin_texts) and not stale
+    if not ok:
+        with open(os.path.join(data_dir, "bot.log"), encoding="utf-8", errors="replace") as f:
+            print("".join(line for line in f if "ERROR" in line or "Traceback" in line)[-3000:])
+    os.chdir("/")
+    if ok:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    else:
+        print(f"Data and bot.log kept in {data_dir}")
+    return ok
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    workers, users, taps = (args + [4, 100, 5][len(args):])[:3]
+    sys.exit(0 if asyncio.run(run(workers, users, taps, 500)) else 1)
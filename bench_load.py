@@ -0,0 +1,194 @@
+"""End-to-end load test of the real routers against a fake Bot API.
+
+Usage: python bench_load.py [users] [rounds] [number_of_books]
+
+Starts the dispatcher from main.py (same stores, hooks and routers) in a
+temporary data directory with a synthetic catalog, long-polling the local
+Bot API stand-in from fake_telegram.py. Each simulated user runs the
+customer script `rounds` times, pressing the buttons the bot actually sent:
+/start -> inline "@bot <prefix>" -> search -> categories -> category -> product -> add to cart ->
+cart -> one more copy -> checkout -> phone -> address -> shipping ->
+receipt photo.
+
+Reports throughput, p50/p99 time spent in each handler, and p50/p99 from
+pushing an update to the end of its processing. No real Telegram traffic is made.
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+TOKEN = "123456:TEST-TOKEN"
+ADMIN_ID = 1
+API_PORT = 18082
+UPDATE_TIMEOUT = 30
+
+# Read by config.py on import, so set before the bot modules are loaded
+os.environ["BOT_TOKEN"] = TOKEN
+os.environ["ADMIN_ID"] = str(ADMIN_ID)
+# Simulated users tap much faster than people do
+os.environ.setdefault("THROTTLE_LIMITS", "0")
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+import main as bot_main
+import orders_db
+from bench_search import make_catalog, make_vocabulary, percentile
+from fake_telegram import FakeTelegramServer
+from handlers import router
+from handlers_admin import admin_router
+
+class ScriptError(Exception):
+    pass
+
+class LoadTest:
+    def __init__(self, api, catalog):
+        self.api = api
+        self.catalog = catalog
+        self.handler_times = defaultdict(list)
+        self.update_times = []
+        self.errors = 0
+        self.script_errors = []
+        self._waiters = {}
+        self._pushed_at = {}
+
+    # --- Middlewares ---
+
+    async def time_handler(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.handler_times[data["handler"].callback.__name__].append(time.perf_counter() - start)
+
+    async def track_update(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.update_times.append(time.perf_counter() - self._pushed_at.pop(event.update_id))
+            waiter = self._waiters.pop(event.update_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    def install(self, dp):
+        dp.update.outer_middleware(self.track_update)
+        for r in (admin_router, router):
+            r.message.middleware(self.time_handler)
+            r.callback_query.middleware(self.time_handler)
+            r.inline_query.middleware(self.time_handler)
+
+    # --- Simulated user ---
+
+    async def send(self, update):
+        """Pushes an update and waits until the dispatcher has processed it."""
+        waiter = asyncio.get_running_loop().create_future()
+        update_id = self.api.push_update(update)
+        self._pushed_at[update_id] = time.perf_counter()
+        self._waiters[update_id] = waiter
+        await asyncio.wait_for(waiter, UPDATE_TIMEOUT)
+
+    async def text(self, user_id, text):
+        await self.send(self.api.message_update(user_id, text=text))
+
+    async def inline(self, user_id, query):
+        # Typing "@bot query": one inline query per keystroke
+        for end in range(1, len(query) + 1):
+            await self.send(self.api.inline_query_update(user_id, query[:end]))
+
+    async def press(self, user_id, prefix, rng):
+        message, data = self.api.find_button(user_id, prefix)
+        if not data:
+            raise ScriptError(f"no {prefix!r} button")
+        await self.send(self.api.callback_update(user_id, rng.choice(data), message))
+
+    async def customer(self, user_id, rounds, rng):
+        for _ in range(rounds):
+            await self.text(user_id, "/start")
+            await self.inline(user_id, rng.choice(self.catalog)["name"][:rng.randint(1, 6)])
+            await self.text(user_id, "🔍 Qidirish")
+            await self.text(user_id, rng.choice(self.catalog)["name"].split()[0])
+            await self.text(user_id, "📚 Kitoblar")
+            await self.press(user_id, "cat_", rng)
+            await self.press(user_id, "prod_", rng)
+            await self.press(user_id, "add_cart_", rng)
+            await self.text(user_id, "🛒 Savat")
+            await self.press(user_id, "cartinc_", rng)
+            await self.press(user_id, "checkout", rng)
+            await self.text(user_id, f"+99890{user_id % 10000000:07d}")
+            await self.text(user_id, "Toshkent, Chilonzor tumani, 1-uy")
+            await self.press(user_id, "ship_", rng)
+            await self.send(self.api.message_update(user_id, photo_file_id=f"receipt-{user_id}"))
+
+    async def run_user(self, user_id, rounds, seed):
+        try:
+            await self.customer(user_id, rounds, random.Random(seed))
+        except (ScriptError, asyncio.TimeoutError) as e:
+            self.script_errors.append((user_id, repr(e)))
+
+def make_data_dir(n_books):
+    """A throwaway working directory with a synthetic catalog and the logo."""
+    source = os.path.dirname(os.path.abspath(__file__))
+    data_dir = tempfile.mkdtemp(prefix="bench_load_")
+    rng = random.Random(42)
+    vocabulary, weights = make_vocabulary(2000, rng)
+    catalog = make_catalog(n_books, vocabulary, weights, rng)
+    for pid, product in catalog.items():
+        product["image"] = f"AgACAgIAAxkB-fake-{pid}"
+    with open(os.path.join(data_dir, "products.json"), "w", encoding="utf-8") as f:
+        json.dump({str(pid): product for pid, product in catalog.items()}, f, ensure_ascii=False)
+    if os.path.exists(os.path.join(source, "logo.jpg")):
+        shutil.copy(os.path.join(source, "logo.jpg"), data_dir)
+    return data_dir, list(catalog.values())
+
+def report(test, elapsed, users, rounds):
+    updates = len(test.update_times)
+    print(f"{users} users x {rounds} rounds: {updates} updates in {elapsed:.2f} s "
+          f"({updates / elapsed:.0f} updates/s, {users * rounds / elapsed:.1f} checkouts/s)")
+    print(f"update latency  p50={percentile(test.update_times, 50) * 1000:.2f} ms  "
+          f"p99={percentile(test.update_times, 99) * 1000:.2f} ms")
+    print(f"\n{'handler':<28} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, samples in sorted(test.handler_times.items(), key=lambda item: -percentile(item[1], 99)):
+        print(f"{name:<28} {len(samples):>6} {percentile(samples, 50) * 1000:>8.2f} {percentile(samples, 99) * 1000:>8.2f}")
+    print("\nBot API calls: " + ", ".join(f"{method}={count}" for method, count in sorted(test.api.method_counts.items())))
+    print(f"Orders in ledger: {len(orders_db.get_orders_between('0000', '9999'))}, "
+          f"handler errors: {test.errors}, failed scripts: {len(test.script_errors)}")
+    for user_id, error in test.script_errors[:5]:
+        print(f"  user {user_id}: {error}")
+
+async def run(users, rounds, n_books):
+    data_dir, catalog = make_data_dir(n_books)
+    os.chdir(data_dir)
+    api = FakeTelegramServer(port=API_PORT)
+    await api.start()
+    dp = bot_main.create_dispatcher()
+    test = LoadTest(api, catalog)
+    test.install(dp)
+    bot = Bot(TOKEN, session=api.session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=True))
+    try:
+        # Startup hooks done: the admin got "Bot ishga tushdi"
+        while not api.outbox.get(ADMIN_ID):
+            await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await asyncio.gather(*(test.run_user(100000 + i, rounds, i) for i in range(users)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await dp.stop_polling()
+        await polling
+        await api.stop()
+    report(test, elapsed, users, rounds)
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    users, rounds, n_books = (args + [50, 1, 1000][len(args):])[:3]
+    asyncio.run(run(users, rounds, n_books))
@@ -0,0 +1,100 @@
+"""Search benchmark on a synthetic catalog.
+
+Usage: python bench_search.py [number_of_books]
+
+Builds a SearchIndex over synthetic books (10 000 by default) and reports
+build time and p50/p99 latency for the old substring scan and for the index,
+both with a cold and a warm query cache.
+"""
+import random
+import sys
+import time
+
+from search import SearchIndex
+
+WORDS = [
+    "kitob", "hayot", "sarmoyachi", "ta'sir", "psixologiya", "bolalar", "o'zbek",
+    "tarix", "g'alaba", "do'stlik", "sabr", "iqtisod", "biznes", "ruh", "qalb",
+    "ilm", "ona", "vatan", "sevgi", "yo'l", "dunyo", "inson", "fikr", "til",
+    "ofat", "qo'shiq", "bahor", "kuz", "tun", "kun", "muvaffaqiyat", "odat",
+]
+CATEGORIES = ["Badiiy", "Psixologiya", "Diniy", "Bolalar adabiyoti", "Biznes"]
+SYLLABLES = ["ka", "bo", "o'", "g'a", "ri", "sha", "lo", "mu", "qa", "ta", "yo", "ne", "zi", "xo", "da"]
+
+def make_vocabulary(size, rng):
+    vocabulary = list(WORDS)
+    while len(vocabulary) < size:
+        vocabulary.append("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    # Zipf-like weights: a few common words, a long tail of rare ones
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    return vocabulary, weights
+
+def make_catalog(n, vocabulary, weights, rng):
+    catalog = {}
+    for pid in range(1, n + 1):
+        name = " ".join(rng.choices(vocabulary, weights, k=rng.randint(1, 4)))
+        description = " ".join(rng.choices(vocabulary, weights, k=rng.randint(40, 120)))
+        catalog[pid] = {
+            "name": name.capitalize(),
+            "price": rng.randint(20, 200) * 1000,
+            "description": description,
+            "image": "",
+            "category": rng.choice(CATEGORIES),
+        }
+    return catalog
+
+def make_queries(n, vocabulary, weights, rng):
+    queries = []
+    for _ in range(n):
+        words = rng.choices(vocabulary, weights, k=rng.randint(1, 2))
+        query = " ".join(words)
+        # Mix in the apostrophe variants users actually type
+        query = query.replace("'", rng.choice(["'", "‘", "ʻ", "’"]))
+        if rng.random() < 0.3:
+            query = query[:max(3, len(query) - 3)]
+        queries.append(query)
+    return queries
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def report(label, samples):
+    print(f"{label:<22} p50={percentile(samples, 50) * 1000:8.3f} ms  "
+          f"p99={percentile(samples, 99) * 1000:8.3f} ms")
+
+def scan_search(catalog, query):
+    query = query.lower()
+    return [pid for pid, p in catalog.items()
+            if query in p["name"].lower() or query in p.get("description", "").lower()]
+
+def timed(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = random.Random(42)
+    vocabulary, weights = make_vocabulary(5000, rng)
+    catalog = make_catalog(n, vocabulary, weights, rng)
+    queries = make_queries(200, vocabulary, weights, rng)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.build(catalog)
+    print(f"{n} books, index build {time.perf_counter() - start:.2f} s, "
+          f"{len(index.postings)} tokens")
+
+    # Both on the same queries, so the percentiles compare the same work
+    report("substring scan", timed(lambda q: scan_search(catalog, q), queries))
+    # Every query is new to the cache on the first pass
+    index.build(catalog)
+    report("index (cold cache)", timed(index.search, queries))
+    report("index (warm cache)", timed(index.search, queries))
+
+if __name__ == "__main__":
+    main()
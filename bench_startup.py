@@ -0,0 +1,47 @@
+"""Startup benchmark: import time and peak RSS of the bot's import path.
+
+Usage: python bench_startup.py [runs]
+
+Each measurement runs in a fresh interpreter. "main" is the current import
+path; "main + pandas" adds the pandas import that analytics.py used to do
+at module load, i.e. the cost before the streaming export.
+"""
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import resource, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, rss_kb)
+"""
+
+CASES = [
+    ("python (empty)", "pass"),
+    ("main + pandas", "import pandas\nimport main"),
+    ("main", "import main"),
+]
+
+def measure(imports):
+    code = SNIPPET.format(imports=imports)
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    elapsed, rss_kb = output.split()
+    return float(elapsed), int(rss_kb)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for label, imports in CASES:
+        try:
+            samples = [measure(imports) for _ in range(runs)]
+        except subprocess.CalledProcessError:
+            print(f"{label:<16} failed (missing dependency?)")
+            continue
+        elapsed = statistics.median(s[0] for s in samples)
+        rss_mb = statistics.median(s[1] for s in samples) / 1024
+        print(f"{label:<16} import {elapsed * 1000:8.1f} ms   peak RSS {rss_mb:7.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""End-to-end check of webhook mode, with update-to-handler latency vs polling.
+
+Usage: python bench_webhook.py [number_of_updates]
+
+Webhook: synthetic Update payloads are POSTed to the app from webhook.py
+on a local port; a request with a wrong secret must be rejected with 401.
+Polling: the same updates are served by the local Bot API stand-in from
+fake_telegram.py and the dispatcher long-polls it. Both runs use a probe
+handler that records when each update reaches it. No real Telegram traffic is made.
+"""
+import asyncio
+import sys
+import time
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+import webhook
+from fake_telegram import FakeTelegramServer
+
+TOKEN = "123456:TEST-TOKEN"
+SECRET = "bench-secret"
+WEBHOOK_PORT = 18080
+API_PORT = 18081
+# Updates arrive at a steady rate in both modes
+INTERVAL = 0.002
+
+def make_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 1000 + update_id % 50, "type": "private"},
+            "from": {"id": 1000 + update_id % 50, "is_bot": False, "first_name": "Bench"},
+            "text": f"ping {update_id}",
+        },
+    }
+
+def make_dispatcher(sent_at, latencies, done, expected):
+    router = Router()
+
+    @router.message()
+    async def probe(message: Message):
+        latencies.append(time.perf_counter() - sent_at[message.message_id])
+        if len(latencies) == expected:
+            done.set()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+def report(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{label:<8} {len(latencies)} updates in {elapsed:.2f} s  "
+          f"p50={p50:.2f} ms  p99={p99:.2f} ms")
+
+async def bench_webhook(n):
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, n)
+    bot = Bot(TOKEN)
+    app, _ = webhook.create_app(dp, bot, secret_token=SECRET, path="/webhook")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WEBHOOK_PORT).start()
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/webhook"
+    try:
+        async with ClientSession() as http:
+            async with http.post(url, json=make_update(0), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+                assert resp.status == 401, f"wrong secret accepted ({resp.status})"
+
+            async def post(update_id):
+                sent_at[update_id] = time.perf_counter()
+                async with http.post(url, json=make_update(update_id),
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                    assert resp.status == 200, resp.status
+
+            start = time.perf_counter()
+            posts = []
+            for i in range(1, n + 1):
+                posts.append(asyncio.create_task(post(i)))
+                await asyncio.sleep(INTERVAL)
+            await asyncio.gather(*posts)
+            await asyncio.wait_for(done.wait(), 60)
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    report("webhook", latencies, elapsed)
+
+async def bench_polling(n):
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, n)
+    api = FakeTelegramServer(port=API_PORT)
+    await api.start()
+    bot = Bot(TOKEN, session=api.session())
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=True))
+    await asyncio.sleep(0.5)
+    try:
+        start = time.perf_counter()
+        for i in range(1, n + 1):
+            sent_at[i] = time.perf_counter()
+            api.push_update(make_update(i))
+            await asyncio.sleep(INTERVAL)
+        await asyncio.wait_for(done.wait(), 60)
+        elapsed = time.perf_counter() - start
+    finally:
+        await dp.stop_polling()
+        await polling
+        await api.stop()
+    report("polling", latencies, elapsed)
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    await bench_webhook(n)
+    await bench_polling(n)
+
+if __name__ == "__main__":
+    asyncio.run(main())
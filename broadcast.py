@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+import users_db
+import fileio
+
+# A broadcast runs as a background job: messages are copied to users in
+# chunks with bounded concurrency behind a token bucket (Telegram allows
+# about 30 msg/s), and after every chunk the progress is checkpointed to
+# JOB_FILE so a restarted bot resumes where it stopped.
+JOB_FILE = "broadcast_job.json"
+RATE_LIMIT = 25
+CONCURRENCY = 10
+CHUNK_SIZE = 100
+PROGRESS_INTERVAL = 5
+MAX_RETRIES = 3
+
+_task = None
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # After a RetryAfter nobody may send until the flood wait is over
+        self.tokens = 0
+        self.updated = time.monotonic() + seconds
+
+def _load_job():
+    if not os.path.exists(JOB_FILE):
+        return None
+    try:
+        with open(JOB_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        logging.exception("Broken broadcast checkpoint %s, ignoring it", JOB_FILE)
+        return None
+
+def _save_job(job):
+    fileio.atomic_write_json(JOB_FILE, job)
+
+def _remove_job():
+    if os.path.exists(JOB_FILE):
+        os.remove(JOB_FILE)
+
+def is_running():
+    return _task is not None and not _task.done()
+
+def _progress_text(job):
+    return (f"📢 Reklama yuborilmoqda: {job['cursor']}/{job['total']}\n\n"
+            f"Qabul qildi: {job['sent']} ta\n"
+            f"Bloklagan: {job['blocked']} ta\n"
+            f"Xato: {job['failed']} ta")
+
+def _report_text(job):
+    return (f"✅ Reklama yuborildi!\n\n"
+            f"Qabul qildi: {job['sent']} ta\n"
+            f"Bloklagan: {job['blocked']} ta\n"
+            f"Xato: {job['failed']} ta")
+
+async def _edit_progress(bot: Bot, job):
+    try:
+        await bot.edit_message_text(_progress_text(job), chat_id=job["admin_chat_id"],
+                                    message_id=job["progress_message_id"])
+    except TelegramBadRequest:
+        # "message is not modified" or the message was deleted
+        pass
+    except TelegramAPIError as e:
+        logging.warning("Broadcast progress update failed: %s", e)
+
+async def _send(bot: Bot, job, user_id, bucket, semaphore):
+    for _ in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            async with semaphore:
+                await bot.copy_message(chat_id=user_id, from_chat_id=job["from_chat_id"],
+                                       message_id=job["message_id"])
+            return "sent"
+        except TelegramRetryAfter as e:
+            logging.warning("Broadcast hit flood limit, waiting %s s", e.retry_after)
+            bucket.pause(e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramAPIError as e:
+            logging.warning("Broadcast to %s failed: %s", user_id, e)
+            return "failed"
+        except Exception:
+            logging.exception("Broadcast to %s failed", user_id)
+            return "failed"
+    return "failed"
+
+async def _run(bot: Bot, job):
+    bucket = TokenBucket(RATE_LIMIT)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    last_progress = time.monotonic()
+
+    # The job only stores a position in the user registry, users are
+    # streamed from there chunk by chunk.
+    users = users_db.iter_users(start=job["cursor"], stop=job["total"])
+    while True:
+        chunk = list(itertools.islice(users, CHUNK_SIZE))
+        if not chunk:
+            break
+        results = await asyncio.gather(*(_send(bot, job, user_id, bucket, semaphore) for _, user_id in chunk))
+
+        newly_blocked = [user_id for (_, user_id), result in zip(chunk, results) if result == "blocked"]
+        if newly_blocked:
+            await users_db.writer.apply(users_db.block, newly_blocked)
+        for result in results:
+            job[result] += 1
+        job["cursor"] = chunk[-1][0] + 1
+        await fileio.run(_save_job, job)
+
+        if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await _edit_progress(bot, job)
+
+    job["cursor"] = job["total"]
+    await _edit_progress(bot, job)
+    try:
+        await bot.send_message(job["admin_chat_id"], _report_text(job))
+    except TelegramAPIError as e:
+        logging.warning("Broadcast report could not be sent: %s", e)
+    await fileio.run(_remove_job)
+    return job
+
+def _spawn(bot: Bot, job):
+    global _task
+    _task = asyncio.create_task(_run(bot, job))
+    return _task
+
+async def start(bot: Bot, message):
+    """Starts broadcasting a copy of message to every active user."""
+    # Users registered by the other workers too (multi-worker mode)
+    await users_db.refresh()
+    total = await fileio.run(users_db.count_users)
+    progress = await message.answer(f"Xabar yuborish boshlandi... ({total} ta foydalanuvchi)")
+    job = {
+        "from_chat_id": message.chat.id,
+        "message_id": message.message_id,
+        "admin_chat_id": message.chat.id,
+        "progress_message_id": progress.message_id,
+        "cursor": 0,
+        "total": total,
+        "sent": 0,
+        "blocked": 0,
+        "failed": 0,
+    }
+    await fileio.run(_save_job, job)
+    return _spawn(bot, job)
+
+async def resume(bot: Bot):
+    # Called on startup, continues an interrupted broadcast
+    job = await fileio.run(_load_job)
+    if job is None or is_running():
+        return
+    logging.info("Resuming broadcast at %d/%d", job["cursor"], job["total"])
+    await users_db.refresh()
+    try:
+        await bot.send_message(job["admin_chat_id"], f"♻️ To'xtab qolgan reklama davom ettirilmoqda ({job['cursor']}/{job['total']})")
+    except TelegramAPIError:
+        pass
+    _spawn(bot, job)
@@ -1,52 +1,249 @@
 import json
 import os
+import sqlite3
+import threading
+import metrics
+import products
 
 CART_FILE = "carts.json"
+CART_DB = "carts.db"
 
-def load_carts():
-    if not os.path.exists(CART_FILE):
-        return {}
+# Carts live in SQLite, one row per user, so a tap only touches that user's
+# row instead of rewriting every cart. WAL mode lets readers run alongside
+# the single writer, and each mutation runs in its own IMMEDIATE transaction
+# so concurrent handlers can't lose each other's updates.
+#
+# A cart maps product id -> quantity and keeps its subtotal next to it. The
+# subtotal is adjusted by one price lookup on every change and is valid for
+# the catalog stamp stored with it (products.get_stamp(), which survives a
+# restart); after a catalog change (a new price, a deleted book) it is
+# recomputed once, in O(distinct items).
+#
+# These functions run on the fileio pool, where the catalog must not be
+# (re)loaded: its listeners update the search and keyboard indexes on the
+# loop. So the caller passes the catalog and its stamp (see storage.py);
+# scripts can leave them out.
+_conn = None
+_lock = threading.Lock()
+
+def _connect():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(CART_DB, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS carts (
+            user_id TEXT PRIMARY KEY,
+            items TEXT NOT NULL,
+            subtotal INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        _migrate_quantities(conn)
+        _migrate_json(conn)
+        _conn = conn
+    return _conn
+
+def _count(product_ids):
+    items = {}
+    for pid in product_ids:
+        items[int(pid)] = items.get(int(pid), 0) + 1
+    return items
+
+def _dump(items):
+    return json.dumps({str(pid): qty for pid, qty in items.items()})
+
+def _migrated(conn, marker):
+    return conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone() is not None
+
+def _migrate_quantities(conn):
+    # One-time conversion of the old duplicate-id lists to quantities; the
+    # subtotal is filled in on first access (version 0 is never a stamp)
+    if _migrated(conn, "qty_migrated"):
+        return
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(CART_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        # Checked again inside the transaction: workers starting together on
+        # an old data directory race to run it, and only the first one may
+        if _migrated(conn, "qty_migrated"):
+            conn.execute("COMMIT")
+            return
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(carts)")]
+        if "subtotal" not in columns:
+            conn.execute("ALTER TABLE carts ADD COLUMN subtotal INTEGER NOT NULL DEFAULT 0")
+        if "version" not in columns:
+            conn.execute("ALTER TABLE carts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        for user_id, items in conn.execute("SELECT user_id, items FROM carts").fetchall():
+            items = json.loads(items)
+            if isinstance(items, list):
+                conn.execute("UPDATE carts SET items = ?, version = 0 WHERE user_id = ?",
+                             (_dump(_count(items)), user_id))
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('qty_migrated', '1')")
+        conn.execute("COMMIT")
     except:
-        return {}
+        conn.execute("ROLLBACK")
+        raise
 
-def save_carts(carts):
-    with open(CART_FILE, "w", encoding="utf-8") as f:
-        json.dump(carts, f, indent=4)
+def _migrate_json(conn):
+    # One-time import of the old carts.json
+    if _migrated(conn, "json_migrated"):
+        return
+    carts = {}
+    if os.path.exists(CART_FILE):
+        try:
+            with open(CART_FILE, "r", encoding="utf-8") as f:
+                carts = json.load(f)
+        except:
+            carts = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if _migrated(conn, "json_migrated"):
+            conn.execute("COMMIT")
+            return
+        for user_id, items in carts.items():
+            conn.execute("INSERT OR IGNORE INTO carts (user_id, items) VALUES (?, ?)",
+                         (str(user_id), _dump(_count(items))))
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('json_migrated', '1')")
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
 
-def add_to_cart(user_id, product_id):
-    carts = load_carts()
-    user_id = str(user_id)
-    if user_id not in carts:
-        carts[user_id] = []
-    
-    # Check if item exists (optional: increase quantity?)
-    # For now, let's treat simply: just append. 
-    # Or prevent duplicates? Let's allow duplicates (multiple same books).
-    carts[user_id].append(int(product_id))
-    save_carts(carts)
-
-def get_cart(user_id):
-    carts = load_carts()
-    return carts.get(str(user_id), [])
-
-def remove_from_cart(user_id, product_id):
-    carts = load_carts()
+def init_db():
+    with _lock:
+        _connect()
+
+def _catalog_view(catalog, stamp):
+    if catalog is None:
+        return products.load_products(), products.get_stamp()
+    return catalog, stamp
+
+def _price(catalog, product_id):
+    product = catalog.get(product_id)
+    return product["price"] if product else 0
+
+def _refresh(cart, catalog, stamp):
+    # Recompute the subtotal for the current catalog, dropping deleted books
+    cart["items"] = {pid: qty for pid, qty in cart["items"].items() if catalog.get(pid)}
+    cart["subtotal"] = sum(_price(catalog, pid) * qty for pid, qty in cart["items"].items())
+    cart["version"] = stamp
+
+def _read(conn, user_id, stamp):
+    # The version column holds the catalog stamp the subtotal was computed for
+    row = conn.execute("SELECT items, subtotal, version FROM carts WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return {"items": {}, "subtotal": 0, "version": stamp}
+    items = {int(pid): qty for pid, qty in json.loads(row[0]).items()}
+    return {"items": items, "subtotal": row[1], "version": row[2]}
+
+def _write(conn, user_id, cart):
+    if cart["items"]:
+        conn.execute("INSERT OR REPLACE INTO carts (user_id, items, subtotal, version) VALUES (?, ?, ?, ?)",
+                     (user_id, _dump(cart["items"]), cart["subtotal"], cart["version"]))
+    else:
+        conn.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+
+def _update(user_id, catalog, stamp, mutate):
+    # Read-modify-write of one user's row inside a single transaction.
+    # mutate(cart, catalog) changes the cart in place and returns the call's result.
     user_id = str(user_id)
-    if user_id in carts:
+    catalog, stamp = _catalog_view(catalog, stamp)
+    with _lock:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cart = _read(conn, user_id, stamp)
+            if cart["version"] != stamp:
+                _refresh(cart, catalog, stamp)
+            result = mutate(cart, catalog)
+            _write(conn, user_id, cart)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+    return result
+
+def _set(cart, catalog, product_id, quantity):
+    # Returns the new quantity of product_id
+    product_id = int(product_id)
+    if quantity > 0 and catalog.get(product_id) is None:
+        quantity = 0
+    old = cart["items"].get(product_id, 0)
+    if quantity > 0:
+        cart["items"][product_id] = quantity
+    else:
+        cart["items"].pop(product_id, None)
+        quantity = 0
+    cart["subtotal"] += (quantity - old) * _price(catalog, product_id)
+    return quantity
+
+def _public(cart, catalog=None):
+    return {"items": cart["items"], "subtotal": cart["subtotal"]}
+
+@metrics.timed("cart")
+def load_carts():
+    with _lock:
+        rows = _connect().execute("SELECT user_id, items FROM carts").fetchall()
+    return {user_id: {int(pid): qty for pid, qty in json.loads(items).items()} for user_id, items in rows}
+
+@metrics.timed("cart")
+def save_carts(carts):
+    # carts maps user id -> {product id: quantity} (a list of ids also works)
+    catalog, stamp = _catalog_view(None, None)
+    with _lock:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            carts[user_id].remove(int(product_id)) # Removes first occurrence
-            save_carts(carts)
-            return True
-        except ValueError:
+            conn.execute("DELETE FROM carts")
+            for user_id, items in carts.items():
+                items = _count(items) if isinstance(items, list) else {int(pid): qty for pid, qty in items.items()}
+                cart = {"items": items}
+                _refresh(cart, catalog, stamp)
+                _write(conn, str(user_id), cart)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+@metrics.timed("cart")
+def add_to_cart(user_id, product_id, quantity=1, catalog=None, stamp=None):
+    # Another tap on the same book raises its quantity; returns the new quantity
+    return _update(user_id, catalog, stamp,
+                   lambda cart, catalog: _set(cart, catalog, product_id, cart["items"].get(int(product_id), 0) + quantity))
+
+@metrics.timed("cart")
+def get_cart(user_id, catalog=None, stamp=None):
+    """Returns {"items": {product_id: quantity}, "subtotal": price sum}."""
+    catalog, stamp = _catalog_view(catalog, stamp)
+    with _lock:
+        cart = _read(_connect(), str(user_id), stamp)
+    if cart["version"] != stamp:
+        return _update(user_id, catalog, stamp, _public)
+    return _public(cart)
+
+@metrics.timed("cart")
+def remove_from_cart(user_id, product_id, catalog=None, stamp=None):
+    # Takes one copy out; returns False if the book wasn't in the cart
+    def remove(cart, catalog):
+        quantity = cart["items"].get(int(product_id), 0)
+        if not quantity:
             return False
-    return False
+        _set(cart, catalog, product_id, quantity - 1)
+        return True
+    return _update(user_id, catalog, stamp, remove)
+
+@metrics.timed("cart")
+def replace_cart(user_id, items, catalog=None, stamp=None):
+    """Replaces the whole cart with items ({product_id: quantity}) in one transaction."""
+    def replace(cart, catalog):
+        cart["items"] = {}
+        cart["subtotal"] = 0
+        for product_id, quantity in items.items():
+            _set(cart, catalog, product_id, quantity)
+        return _public(cart)
+    return _update(user_id, catalog, stamp, replace)
 
+@metrics.timed("cart")
 def clear_cart(user_id):
-    carts = load_carts()
-    user_id = str(user_id)
-    if user_id in carts:
-        del carts[user_id]
-        save_carts(carts)   
+    with _lock:
+        _connect().execute("DELETE FROM carts WHERE user_id = ?", (str(user_id),))
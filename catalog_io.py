@@ -0,0 +1,181 @@
+import codecs
+import csv
+import os
+
+# Bulk catalog import/export for admins (/import, /export). Files are read
+# and written row by row, so a publisher's list of thousands of titles never
+# sits in memory as a spreadsheet: rows are validated as they stream in and
+# only the valid products are kept for the single batch commit
+# (products.import_products). CSV and XLSX are supported; openpyxl is only
+# imported for XLSX.
+COLUMNS = ["id", "name", "category", "price", "description", "image"]
+# Header aliases, so a sheet with Uzbek column names works too
+ALIASES = {
+    "nomi": "name", "nom": "name",
+    "kategoriya": "category", "kategoriyasi": "category", "bo'lim": "category",
+    "narx": "price", "narxi": "price",
+    "tavsif": "description", "tavsifi": "description",
+    "rasm": "image", "rasmi": "image",
+}
+DEFAULT_CATEGORY = "Boshqa"
+# Columns a new book gets when the file leaves them out
+NEW_PRODUCT = {"category": DEFAULT_CATEGORY, "description": "", "image": ""}
+MAX_ROWS = 20000
+MAX_REPORTED_ERRORS = 50
+
+class ImportResult:
+    def __init__(self):
+        self.products = []  # (product_id or None, data) in file order
+        self.errors = []    # (row number, message), the first MAX_REPORTED_ERRORS
+        self.error_count = 0
+        self.rows = 0
+
+    def error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+def _header(cells):
+    names = []
+    for cell in cells:
+        name = str(cell or "").strip().lower()
+        names.append(ALIASES.get(name, name))
+    return names
+
+def _csv_rows(path):
+    with open(path, "rb") as f:
+        head = f.read(65536)
+    try:
+        # Incremental, so a character cut in half at the end of head is fine
+        codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        # Excel on Windows saves CSV in the ANSI code page
+        encoding = "cp1251"
+    with open(path, "r", encoding=encoding, newline="") as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.read(4096), delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        yield from csv.reader(f, dialect)
+
+def _xlsx_rows(path):
+    from openpyxl import load_workbook
+
+    # read_only streams the sheet instead of loading it whole
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+def iter_rows(path):
+    """Yields each row of a CSV or XLSX file as a list of cells."""
+    if path.lower().endswith(".xlsx"):
+        return _xlsx_rows(path)
+    return _csv_rows(path)
+
+def _parse_number(value):
+    # A positive whole number; "50 000", "50,000", "50000 so'm" and 50000.0 all work
+    if isinstance(value, (int, float)):
+        price = value
+    else:
+        text = str(value).strip().replace(" ", "").replace("\u00a0", "").replace(",", "")
+        text = text.lower().removesuffix("so'm").removesuffix("som")
+        price = float(text)
+    if price != int(price) or price <= 0:
+        raise ValueError
+    return int(price)
+
+def validate_row(row):
+    """Turns a {column: cell} row into (product_id or None, product).
+
+    product only has the columns present in the row, so updating an existing
+    book leaves the others alone; a new book gets NEW_PRODUCT for them. An
+    empty category cell counts as missing. Raises ValueError with a message
+    for the admin.
+    """
+    name = str(row.get("name", "")).strip()
+    if not name:
+        raise ValueError("nomi (name) bo'sh")
+    try:
+        price = _parse_number(row.get("price", ""))
+    except (ValueError, OverflowError):
+        raise ValueError(f"narx noto'g'ri: {row.get('price', '')!r}")
+
+    product_id = None
+    raw_id = str(row.get("id", "")).strip()
+    if raw_id:
+        try:
+            product_id = _parse_number(raw_id)
+        except (ValueError, OverflowError):
+            raise ValueError(f"id noto'g'ri: {raw_id!r}")
+
+    product = {"name": name, "price": price}
+    for column in ("category", "description", "image"):
+        if column in row:
+            product[column] = str(row[column]).strip()
+    if not product.get("category"):
+        product.pop("category", None)
+    return product_id, product
+
+def read_catalog_file(path):
+    """Streams and validates a CSV/XLSX catalog. Blocking, run it on the fileio pool."""
+    result = ImportResult()
+    rows = iter_rows(path)
+    header = None
+    seen_ids = {}
+    for row_number, cells in enumerate(rows, start=1):
+        if not any(str(cell).strip() for cell in cells):
+            continue
+        if header is None:
+            header = _header(cells)
+            missing = [column for column in ("name", "price") if column not in header]
+            if missing:
+                result.error(row_number, "sarlavhada ustun yo'q: " + ", ".join(missing))
+                return result
+            continue
+        result.rows += 1
+        if result.rows > MAX_ROWS:
+            result.error(row_number, f"{MAX_ROWS} qatordan ko'p, qolganlari o'tkazib yuborildi")
+            break
+        try:
+            product_id, product = validate_row(dict(zip(header, cells)))
+        except ValueError as e:
+            result.error(row_number, str(e))
+            continue
+        if product_id is not None:
+            if product_id in seen_ids:
+                result.error(row_number, f"id {product_id} {seen_ids[product_id]}-qatorda ham bor")
+                continue
+            seen_ids[product_id] = row_number
+        result.products.append((product_id, product))
+    if header is None:
+        result.error(1, "fayl bo'sh")
+    return result
+
+def export_catalog(catalog, path):
+    """Writes catalog ({id: product}) to a CSV or XLSX file, row by row."""
+    rows = ([pid] + [catalog[pid].get(column, "") for column in COLUMNS[1:]] for pid in sorted(catalog))
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Kitoblar")
+        sheet.append(COLUMNS)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+    else:
+        # utf-8-sig so Excel opens Uzbek text correctly
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+    return path
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
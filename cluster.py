@@ -0,0 +1,452 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sqlite3
+import sys
+from contextlib import asynccontextmanager
+from store_writer import StoreWriter
+
+# Multi-worker mode (BOT_WORKERS > 1). `python main.py` then runs a
+# supervisor instead of the bot. It starts BOT_WORKERS worker processes
+# (main.py again, with BOT_WORKER_INDEX set) and receives the updates
+# itself, by long polling or webhook. Each update is forwarded over
+# localhost to worker user_id % BOT_WORKERS; admins always go to worker 0.
+# So one user's updates always reach the same worker, and per-user state
+# (conversation, cart, throttle buckets) has a single writer.
+#
+# The workers share the data directory. The SQLite stores (carts, orders,
+# FSM) are safe across processes as they are. The file stores take the
+# cluster lock (a write transaction on CLUSTER_DB; SQLite releases it if
+# the process dies) around every write. Catalog changes are applied on top
+# of the newest catalog and written through, and every commit bumps the
+# store's version in CLUSTER_DB and is announced to the other workers, which
+# reload.
+#
+# Worker 0 is the primary: it gets the admins, runs broadcasts, sends the
+# start/stop notices and compacts the user registry.
+CLUSTER_DB = "cluster.db"
+UPDATE_PATH = "/update"
+INVALIDATE_PATH = "/invalidate"
+PING_PATH = "/ping"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+LOCK_POLL = 0.005
+LOCK_POLL_MAX = 0.05
+POLL_TIMEOUT = 30
+FORWARD_QUEUE_SIZE = 1000
+FORWARD_RETRY = 0.5
+FORWARD_TIMEOUT = 60
+DRAIN_TIMEOUT = 30
+ANNOUNCE_TIMEOUT = 5
+WORKER_START_TIMEOUT = 60
+RESTART_DELAY = 1
+
+_worker_index = os.getenv("BOT_WORKER_INDEX")
+_conn = None
+_lock = asyncio.Lock()
+_invalidate_handlers = {}
+_session = None
+
+def enabled():
+    """True in a worker process of the multi-worker mode."""
+    return _worker_index is not None
+
+def worker_index():
+    return int(_worker_index) if _worker_index is not None else None
+
+def is_primary():
+    # A single bot process is its own primary
+    return _worker_index is None or int(_worker_index) == 0
+
+def _secret():
+    return os.getenv("BOT_CLUSTER_SECRET", "")
+
+def shard(user_id, workers, admin_ids=()):
+    if str(user_id) in admin_ids:
+        return 0
+    return user_id % workers
+
+def update_user_id(update):
+    """The id of the user behind a raw update (the chat for channel posts), or 0."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+# --- Cross-process lock and store versions ---
+
+def _connect():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(CLUSTER_DB, timeout=5, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        # lock() polls instead of letting SQLite block the event loop
+        conn.execute("PRAGMA busy_timeout=0")
+        _conn = conn
+    return _conn
+
+@asynccontextmanager
+async def lock():
+    """Cross-process lock around writes to the shared file stores.
+
+    A no-op in a single bot process. Not reentrant.
+    """
+    if not enabled():
+        yield
+        return
+    async with _lock:
+        conn = _connect()
+        delay = LOCK_POLL
+        while True:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX)
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+
+def get_version(name):
+    row = _connect().execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def bump_version(name):
+    # Only while holding lock()
+    _connect().execute("INSERT INTO versions (name, version) VALUES (?, 1) "
+                       "ON CONFLICT (name) DO UPDATE SET version = version + 1", (name,))
+    return get_version(name)
+
+# --- Invalidation ---
+
+def on_invalidate(name, handler):
+    # handler(version) runs when another worker announces a commit to `name`
+    _invalidate_handlers[name] = handler
+
+async def _announce_to(url, payload):
+    from aiohttp import ClientTimeout
+
+    try:
+        async with _session.post(url, json=payload, headers={SECRET_HEADER: _secret()},
+                                 timeout=ClientTimeout(total=ANNOUNCE_TIMEOUT)) as response:
+            if response.status != 200:
+                logging.warning("Invalidation to %s failed: HTTP %s", url, response.status)
+    except Exception as e:
+        # The worker is restarting; it loads the newest version on start
+        logging.warning("Invalidation to %s failed: %s", url, e)
+
+async def announce(name, version):
+    """Tells the other workers that `name` is now at `version`."""
+    import config
+
+    if not enabled() or _session is None:
+        return
+    payload = {"name": name, "version": version}
+    await asyncio.gather(*(_announce_to(_worker_url(config, i, INVALIDATE_PATH), payload)
+                           for i in range(config.BOT_WORKERS) if i != worker_index()))
+
+class SharedWriter(StoreWriter):
+    """StoreWriter for a file store shared by the workers.
+
+    Every unit of work runs under the cluster lock, on top of the newest
+    committed version of the store (reload() is called first if another
+    worker committed since), and is written before the lock is released.
+    A commit bumps the store's version and is announced to the other workers.
+    There is no coalescing; this is for rarely changed stores like the catalog.
+    """
+
+    def __init__(self, name, snapshot, write, reload):
+        super().__init__(name, snapshot, write)
+        self._reload = reload
+        self.version = None
+        on_invalidate(name, self.catch_up)
+
+    def catch_up(self, version):
+        if self.version is None or version > self.version:
+            self._reload()
+            self.version = version
+
+    def is_running(self):
+        return self.version is not None
+
+    async def apply(self, func, *args, durable=False):
+        async with lock():
+            self.catch_up(get_version(self.name))
+            result = func(*args)
+            flushes = self.flushes
+            try:
+                await self.flush_now()
+            except Exception:
+                # The cache is ahead of the file, go back to the file
+                self._reload()
+                raise
+            changed = self.flushes != flushes
+            if changed:
+                self.version = bump_version(self.name)
+        if changed:
+            await announce(self.name, self.version)
+        return result
+
+    async def start(self):
+        # The cache is loaded from the file as it is now
+        self.version = get_version(self.name)
+
+    async def stop(self):
+        pass
+
+# --- Worker ---
+
+def _worker_url(config, index, path):
+    return f"http://{config.WORKER_HOST}:{config.WORKER_BASE_PORT + index}{path}"
+
+async def _wait_for_stop(ignore_sigint=False):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        # Ctrl+C reaches the whole process group; workers leave the shutdown
+        # order to the supervisor, which drains its queues first
+        loop.add_signal_handler(signal.SIGINT, (lambda: None) if ignore_sigint else stop.set)
+    except NotImplementedError:
+        # Windows: KeyboardInterrupt stops the process instead
+        pass
+    await stop.wait()
+
+async def run_worker(dp, bot):
+    """Serves updates forwarded by the supervisor until SIGTERM."""
+    global _session
+    from aiohttp import ClientSession, web
+    import config
+    import webhook
+
+    async def handle_invalidate(request):
+        if request.headers.get(SECRET_HEADER) != _secret():
+            return web.Response(status=401)
+        payload = await request.json()
+        handler = _invalidate_handlers.get(payload["name"])
+        if handler is not None:
+            handler(payload["version"])
+        return web.json_response({})
+
+    async def handle_ping(request):
+        return web.json_response({"worker": worker_index()})
+
+    # Same queued handler as webhook mode, the supervisor posts like Telegram does
+    app, _ = webhook.create_app(dp, bot, secret_token=_secret(), path=UPDATE_PATH)
+    app.router.add_post(INVALIDATE_PATH, handle_invalidate)
+    app.router.add_get(PING_PATH, handle_ping)
+    _session = ClientSession()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.WORKER_HOST, config.WORKER_BASE_PORT + worker_index()).start()
+        logging.info("Worker %d of %d ready", worker_index(), config.BOT_WORKERS)
+        await _wait_for_stop(ignore_sigint=True)
+    finally:
+        await runner.cleanup()
+        await _session.close()
+        _session = None
+
+# --- Supervisor ---
+
+class Supervisor:
+    def __init__(self, config, workers):
+        self.config = config
+        self.workers = workers
+        self.secret = secrets.token_urlsafe(32)
+        self.queues = [asyncio.Queue(FORWARD_QUEUE_SIZE) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.stopping = False
+        self.session = None
+        self.offset = None
+
+    def _api_url(self, method):
+        from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+        api = TelegramAPIServer.from_base(self.config.BOT_API_URL) if self.config.BOT_API_URL else PRODUCTION
+        return api.api_url(token=self.config.BOT_TOKEN, method=method)
+
+    async def _call(self, method, request_timeout, **params):
+        from aiohttp import ClientTimeout
+
+        async with self.session.post(self._api_url(method), json=params,
+                                     timeout=ClientTimeout(total=request_timeout)) as response:
+            data = await response.json()
+        if not data.get("ok"):
+            raise RuntimeError(f"{method}: {data.get('description')}")
+        return data["result"]
+
+    # Workers
+
+    async def _watch(self, index):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        env = dict(os.environ, BOT_WORKER_INDEX=str(index), BOT_CLUSTER_SECRET=self.secret)
+        while not self.stopping:
+            process = await asyncio.create_subprocess_exec(sys.executable, script, env=env)
+            self.processes[index] = process
+            code = await process.wait()
+            if not self.stopping:
+                logging.error("Worker %d exited with %s, restarting", index, code)
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def _wait_ready(self, index):
+        url = _worker_url(self.config, index, PING_PATH)
+        deadline = asyncio.get_running_loop().time() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                async with self.session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(f"Worker {index} did not start")
+            await asyncio.sleep(0.2)
+
+    async def _forward(self, index):
+        # One at a time per worker, so a user's updates arrive in order
+        url = _worker_url(self.config, index, UPDATE_PATH)
+        queue = self.queues[index]
+        while True:
+            update = await queue.get()
+            deadline = asyncio.get_running_loop().time() + FORWARD_TIMEOUT
+            try:
+                while True:
+                    try:
+                        async with self.session.post(url, json=update, headers={SECRET_HEADER: self.secret}) as response:
+                            if response.status == 200:
+                                break
+                            error = f"HTTP {response.status}"
+                    except OSError as e:
+                        error = str(e)
+                    if asyncio.get_running_loop().time() > deadline:
+                        logging.error("Dropping update %s for worker %d: %s", update.get("update_id"), index, error)
+                        break
+                    # Busy or restarting
+                    await asyncio.sleep(FORWARD_RETRY)
+            finally:
+                queue.task_done()
+
+    async def dispatch(self, update):
+        index = shard(update_user_id(update), self.workers, self.config.ADMIN_IDS)
+        await self.queues[index].put(update)
+
+    # Update sources
+
+    async def _poll(self):
+        offset = None
+        while True:
+            try:
+                updates = await self._call("getUpdates", POLL_TIMEOUT + 10, offset=offset, timeout=POLL_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.dispatch(update)
+                offset = update["update_id"] + 1
+            self.offset = offset
+
+    async def _confirm(self):
+        # getUpdates confirms the previous batch only on the next call; make
+        # that call now so the updates already forwarded aren't sent again
+        if self.offset is not None:
+            try:
+                await self._call("getUpdates", 10, offset=self.offset, timeout=0, limit=1)
+            except Exception as e:
+                logging.warning("Could not confirm the last updates: %s", e)
+
+    async def _serve_webhook(self):
+        from aiohttp import web
+
+        secret_token = self.config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+        async def handle(request):
+            if request.headers.get(SECRET_HEADER) != secret_token:
+                return web.Response(status=401)
+            update = await request.json()
+            queue = self.queues[shard(update_user_id(update), self.workers, self.config.ADMIN_IDS)]
+            if queue.full():
+                # Telegram retries on 503
+                return web.Response(status=503, text="Busy")
+            queue.put_nowait(update)
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_post(self.config.WEBHOOK_PATH, handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.config.WEBHOOK_HOST, self.config.WEBHOOK_PORT).start()
+            await self._call("setWebhook", 30, url=self.config.WEBHOOK_BASE_URL.rstrip("/") + self.config.WEBHOOK_PATH,
+                             secret_token=secret_token)
+            logging.info("Webhook server listening on %s:%s", self.config.WEBHOOK_HOST, self.config.WEBHOOK_PORT)
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def run(self):
+        from aiohttp import ClientSession
+
+        self.session = ClientSession()
+        # Listening for SIGTERM from the start: stopped while the workers are
+        # still starting, the supervisor must still stop them
+        stop = asyncio.create_task(_wait_for_stop())
+        watchers = [asyncio.create_task(self._watch(i)) for i in range(self.workers)]
+        ready = asyncio.gather(*(self._wait_ready(i) for i in range(self.workers)))
+        forwarders = []
+        source = None
+        try:
+            await asyncio.wait([ready, stop], return_when=asyncio.FIRST_COMPLETED)
+            if not stop.done():
+                ready.result()
+                logging.info("%d workers ready", self.workers)
+                forwarders = [asyncio.create_task(self._forward(i)) for i in range(self.workers)]
+                if self.config.BOT_MODE == "webhook":
+                    source = asyncio.create_task(self._serve_webhook())
+                else:
+                    source = asyncio.create_task(self._poll())
+                await asyncio.wait([source, stop], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            ready.cancel()
+            await asyncio.gather(ready, return_exceptions=True)
+            self.stopping = True
+            if source is not None:
+                source.cancel()
+                await asyncio.gather(source, return_exceptions=True)
+                if self.config.BOT_MODE != "webhook":
+                    await self._confirm()
+            # Updates already taken from Telegram reach their worker first
+            if forwarders:
+                try:
+                    await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logging.warning("Shutdown with %d updates not forwarded", sum(q.qsize() for q in self.queues))
+            for task in forwarders:
+                task.cancel()
+            # SIGTERM: each worker drains its own queue and runs its shutdown hooks
+            for process in self.processes:
+                if process is not None and process.returncode is None:
+                    process.terminate()
+            await asyncio.gather(*watchers, return_exceptions=True)
+            await self.session.close()
+
+async def run_supervisor():
+    import config
+
+    await Supervisor(config, config.BOT_WORKERS).run()
@@ -5,3 +5,32 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = os.getenv("ADMIN_ID").split(",")
+
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Public HTTPS address Telegram posts to, e.g. https://bot.example.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Random per start if not set
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics), 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Per-user rate limits by handler class, "class=rate/burst,...", e.g.
+# "cart=2/8,search=1/5" (see throttle.LIMITS); "0" turns throttling off
+THROTTLE_LIMITS = os.getenv("THROTTLE_LIMITS", "")
+
+# Multi-worker mode (see cluster.py): with BOT_WORKERS > 1 main.py runs a
+# supervisor that starts this many bot processes and shards updates between
+# them by user id. Worker i listens on WORKER_HOST:WORKER_BASE_PORT+i and
+# serves metrics on METRICS_PORT+i
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_HOST = os.getenv("WORKER_HOST", "127.0.0.1")
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+
+# Bot API server, e.g. a local telegram-bot-api; empty means api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from aiohttp import web
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+# A local stand-in for the Telegram Bot API, for benchmarks and load tests.
+# Updates are queued with push_update() and handed out by getUpdates (long
+# polling); every call the bot makes is recorded in `calls`, and the messages
+# it sends or edits are kept per chat in `outbox` so a simulated user can read
+# the last keyboard and press one of its buttons. Nothing leaves the machine.
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+MAX_UPDATES = 100
+
+class FakeTelegramServer:
+    def __init__(self, host="127.0.0.1", port=18081):
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.method_counts = Counter()
+        self.outbox = defaultdict(list)
+        self.answers = {}
+        # Calls concerning each user (messages to their chat, answers to
+        # their callback queries), for clients that can't hook the dispatcher
+        self.activity = Counter()
+        self._callback_users = {}
+        self.answered = set()
+        self._messages = {}
+        self._files = {}
+        self._pending = []
+        self._available = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def session(self):
+        """An aiogram session that talks to this server instead of Telegram."""
+        return AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # --- Updates ---
+
+    def push_update(self, update):
+        """Queues an update for getUpdates; returns its update_id."""
+        update.setdefault("update_id", next(self._update_ids))
+        self._pending.append(update)
+        self._available.set()
+        return update["update_id"]
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message_update(self, user_id, text=None, photo_file_id=None):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+        }
+        if photo_file_id is not None:
+            message["photo"] = [{"file_id": photo_file_id, "file_unique_id": photo_file_id, "width": 800, "height": 600}]
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def document_update(self, user_id, file_name, content):
+        """A user sending a file; the bot can fetch it with getFile/download."""
+        file_id = f"fake-doc-{next(self._file_ids)}"
+        self._files[file_id] = content
+        update = self.message_update(user_id, text="")
+        del update["message"]["text"]
+        update["message"]["document"] = {"file_id": file_id, "file_unique_id": file_id,
+                                         "file_name": file_name, "file_size": len(content)}
+        return update
+
+    def callback_update(self, user_id, data, message):
+        """A button press on `message`, one of the bot's messages from outbox."""
+        callback_id = str(next(self._callback_ids))
+        self._callback_users[callback_id] = user_id
+        return {"callback_query": {
+            "id": callback_id,
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        }}
+
+    def inline_query_update(self, user_id, query, offset=""):
+        """A user typing "@bot query"; the answer is recorded in `answers`."""
+        return {"inline_query": {
+            "id": str(next(self._callback_ids)),
+            "from": self.user(user_id),
+            "query": query,
+            "offset": offset,
+        }}
+
+    def last_message(self, chat_id):
+        messages = self.outbox.get(chat_id)
+        return messages[-1] if messages else None
+
+    def find_button(self, chat_id, prefix):
+        """Latest message in the chat with an inline button whose callback_data
+        starts with prefix; returns (message, [callback_data, ...]) or (None, [])."""
+        for message in reversed(self.outbox.get(chat_id, [])):
+            markup = message.get("reply_markup") or {}
+            data = [button["callback_data"]
+                    for row in markup.get("inline_keyboard", [])
+                    for button in row
+                    if button.get("callback_data", "").startswith(prefix)]
+            if data:
+                return message, data
+        return None, []
+
+    # --- API ---
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        # Form fields are strings (JSON for markup), uploads are FileFields;
+        # like Telegram, a JSON body works too
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post()) if request.can_read_body else {}
+        self.method_counts[method] += 1
+
+        if method.lower() == "getupdates":
+            result = await self._get_updates(params)
+        else:
+            self.calls.append({"method": method, "params": params, "time": time.perf_counter()})
+            user_id = self._callback_users.get(params.get("callback_query_id"))
+            if user_id is None and str(params.get("chat_id", "")).lstrip("-").isdigit():
+                user_id = int(params["chat_id"])
+            if user_id is not None:
+                self.activity[user_id] += 1
+            handler = getattr(self, "_api_" + method.lower(), None)
+            try:
+                result = handler(params) if handler is not None else True
+            except KeyError as e:
+                # A required parameter is missing, e.g. an empty photo
+                return web.json_response({"ok": False, "error_code": 400,
+                                          "description": f"Bad Request: parameter {e} is required"})
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self._pending[:] = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending:
+            self._available.clear()
+            try:
+                await asyncio.wait_for(self._available.wait(), float(params.get("timeout") or 0) or 0.5)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or MAX_UPDATES)
+        return self._pending[:limit]
+
+    def _api_getme(self, params):
+        return BOT_USER
+
+    def _api_getfile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id,
+                "file_size": len(self._files.get(file_id, b"")), "file_path": f"documents/{file_id}"}
+
+    async def _download(self, request):
+        content = self._files.get(request.match_info["path"].rsplit("/", 1)[-1])
+        if content is None:
+            return web.Response(status=404)
+        return web.Response(body=content)
+
+    def _new_message(self, params, **fields):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+        markup = self._inline_markup(params)
+        if markup is not None:
+            message["reply_markup"] = markup
+        self._messages[(chat_id, message["message_id"])] = message
+        self.outbox[chat_id].append(message)
+        return message
+
+    @staticmethod
+    def _inline_markup(params):
+        # Like Telegram, a Message only carries inline keyboards; reply
+        # keyboards (the main menu) are not echoed back
+        markup = json.loads(params.get("reply_markup") or "null")
+        if markup and "inline_keyboard" in markup:
+            return markup
+        return None
+
+    def _file_id(self, params, field):
+        # An upload gets a new file_id, a file_id or URL is sent back as is
+        value = params[field]
+        if isinstance(value, str) and value.startswith("attach://"):
+            value = params.get(value[len("attach://"):], value)
+        if isinstance(value, web.FileField):
+            return f"fake-file-{next(self._file_ids)}"
+        return value
+
+    def _api_sendmessage(self, params):
+        return self._new_message(params, text=params.get("text", ""))
+
+    def _api_sendphoto(self, params):
+        file_id = self._file_id(params, "photo")
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+        return self._new_message(params, photo=photo, caption=params.get("caption", ""))
+
+    def _api_senddocument(self, params):
+        file_id = self._file_id(params, "document")
+        return self._new_message(params, document={"file_id": file_id, "file_unique_id": file_id})
+
+    def _api_copymessage(self, params):
+        message = self._new_message(params, text="(copy)")
+        return {"message_id": message["message_id"]}
+
+    def _edit(self, params, **fields):
+        if "inline_message_id" in params:
+            return True
+        message = self._messages.get((int(params["chat_id"]), int(params["message_id"])))
+        if message is None:
+            message = self._new_message(params)
+        message.update(fields)
+        markup = self._inline_markup(params)
+        if markup is not None:
+            message["reply_markup"] = markup
+        else:
+            message.pop("reply_markup", None)
+        return message
+
+    def _api_editmessagetext(self, params):
+        return self._edit(params, text=params.get("text", ""))
+
+    def _api_editmessagecaption(self, params):
+        return self._edit(params, caption=params.get("caption", ""))
+
+    def _api_editmessagereplymarkup(self, params):
+        return self._edit(params)
+
+    def _api_answerinlinequery(self, params):
+        self.answers[params["inline_query_id"]] = {
+            "results": json.loads(params.get("results") or "[]"),
+            "next_offset": params.get("next_offset", ""),
+        }
+        return True
+
+    def _api_answercallbackquery(self, params):
+        self.answered.add(params["callback_query_id"])
+        return True
+
+    def _api_deletemessage(self, params):
+        message = self._messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+        if message is not None:
+            self.outbox[message["chat"]["id"]].remove(message)
+        return True
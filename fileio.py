@@ -0,0 +1,51 @@
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking file and database I/O runs on this bounded pool instead of the
+# event loop. Writers to the same file are serialized with a per-file lock,
+# and every write goes to a temp file that is renamed over the target, so a
+# crash mid-write leaves either the old or the new file, never a truncated one.
+MAX_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="storage")
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def submit(func, *args, **kwargs):
+    # Fire-and-forget background work from synchronous code
+    return _executor.submit(func, *args, **kwargs)
+
+def file_lock(path):
+    path = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = threading.RLock()
+        return lock
+
+def atomic_write_text(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    with file_lock(path):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def atomic_write_json(path, data, **dump_kwargs):
+    atomic_write_text(path, json.dumps(data, **dump_kwargs))
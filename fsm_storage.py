@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+import fileio
+
+FSM_DB = "fsm.db"
+
+# How long an untouched conversation is kept, by state (exact name first,
+# then the StatesGroup name). Customers told to send a receipt get the
+# longest; a half-typed search is dropped quickly. DATA_TTL covers keys that
+# only hold data (e.g. the last search query for result pages).
+STATE_TTLS = {
+    "OrderState:waiting_for_receipt": 3 * 24 * 3600,
+    "OrderState": 24 * 3600,
+    "SearchState": 3600,
+    "FeedbackState": 6 * 3600,
+    "ProductState": 24 * 3600,
+    "EditProductState": 6 * 3600,
+    "BroadcastState": 3600,
+    "ImportState": 3600,
+}
+DEFAULT_TTL = 24 * 3600
+DATA_TTL = 24 * 3600
+SWEEP_INTERVAL = 600
+
+def ttl_for(state):
+    if state is None:
+        return DATA_TTL
+    if state in STATE_TTLS:
+        return STATE_TTLS[state]
+    return STATE_TTLS.get(state.split(":", 1)[0], DEFAULT_TTL)
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in a local SQLite file.
+
+    Conversations survive a restart, and every write moves the record's
+    expiry forward by the TTL of its state. Expired records read as empty
+    and are deleted by the sweeper started with start_sweeper().
+    """
+
+    def __init__(self, path=FSM_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires_at)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(key):
+        # business_connection_id only exists from aiogram 3.4; before that it
+        # is None here, which gives the same key
+        return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                                getattr(key, "business_connection_id", None), key.destiny))
+
+    def _read(self, key):
+        row = self._connect().execute("SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None or row[2] < time.time():
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, key, state, data):
+        conn = self._connect()
+        if state is None and not data:
+            # Nothing left to remember, keep the table small
+            conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+                         (key, state, json.dumps(data, ensure_ascii=False), time.time() + ttl_for(state)))
+
+    def _set_state_sync(self, key, state):
+        with self._lock:
+            _, data = self._read(key)
+            self._write(key, state, data)
+
+    def _set_data_sync(self, key, data):
+        with self._lock:
+            state, _ = self._read(key)
+            self._write(key, state, data)
+
+    def _update_data_sync(self, key, data):
+        with self._lock:
+            state, current = self._read(key)
+            current.update(data)
+            self._write(key, state, current)
+            return current
+
+    def _get_sync(self, key):
+        with self._lock:
+            return self._read(key)
+
+    def sweep(self):
+        with self._lock:
+            cursor = self._connect().execute("DELETE FROM fsm WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await fileio.run(self._set_state_sync, self._key(key), state)
+
+    async def get_state(self, key):
+        state, _ = await fileio.run(self._get_sync, self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        await fileio.run(self._set_data_sync, self._key(key), dict(data))
+
+    async def get_data(self, key):
+        _, data = await fileio.run(self._get_sync, self._key(key))
+        return data
+
+    async def update_data(self, key, data):
+        # One read-modify-write under the lock instead of get + set
+        current = await fileio.run(self._update_data_sync, self._key(key), dict(data))
+        return current.copy()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                removed = await fileio.run(self.sweep)
+                if removed:
+                    logging.info("Evicted %d abandoned FSM sessions", removed)
+            except Exception:
+                logging.exception("FSM sweep failed")
+
+    async def start_sweeper(self):
+        await fileio.run(self.sweep)
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,16 +1,24 @@
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InputFile, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import CommandStart
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (InlineQuery, InlineQueryResultCachedPhoto, InlineQueryResultPhoto,
+                           InlineQueryResultArticle, InputTextMessageContent)
+from aiogram.filters import CommandStart, CommandObject, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from products import load_products
-from users_db import add_user
+from products import load_products, get_product
 import keyboards as kb
 import config
 import os
+import re
 import uuid
-from cart_db import add_to_cart, get_cart, clear_cart, remove_from_cart
+import storage
 from analytics import log_search, log_order
+from search import search_products, suggest_products
+from notify import notify_admins_background
+import media_cache
+import images
+import fileio
 
 router = Router()
 
@@ -27,21 +35,31 @@ class SearchState(StatesGroup):
 class FeedbackState(StatesGroup):
     waiting_for_text = State()
 
+@router.message(CommandStart(deep_link=True, magic=F.args.regexp(r"^book_\d+$")))
+async def cmd_start_book(message: Message, state: FSMContext, command: CommandObject):
+    # t.me/<bot>?start=book_<id> links from inline results open the book
+    await state.clear()
+    await storage.add_user(message.from_user.id)
+    if not await send_product(message, int(command.args.split("_")[1])):
+        await message.answer("😔 Bu kitob endi mavjud emas.", reply_markup=kb.main_menu)
+
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
-    add_user(message.from_user.id)
+    await storage.add_user(message.from_user.id)
     
     share_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="♻️ Do'stlarimga ulashish", switch_inline_query="\nSalom! Men Niholbooks orqali kitob olyapman. Tavsiya qilaman!")]
     ])
     
     if os.path.exists("logo.jpg"):
-        await message.answer_photo(
-            FSInputFile("logo.jpg"), 
+        # Optimized and uploaded once, then sent by file_id
+        logo = await fileio.run(images.optimize, "logo.jpg")
+        await media_cache.send_photo(lambda photo: message.answer_photo(
+            photo, 
             caption=f"Assalomu alaykum, {message.from_user.full_name}! Niholbooks botiga xush kelibsiz.\nQuyidagi menudan kerakli bo'limni tanlang:",
             reply_markup=kb.main_menu
-        )
+        ), logo)
         # Send separate message for share button if you want it sticky, or attach to photo?
         # Attaching to photo overrides reply_markup main_menu if we are not careful.
         # ReplyKeyboardMarkup sends a separate menu. Inline attaches to message.
@@ -66,6 +84,17 @@ async def show_books_in_category(callback: CallbackQuery):
     await callback.message.edit_text(f"📂 {category}\nKitobni tanlang:", reply_markup=kb.get_products_keyboard(category=category))
     await callback.answer()
 
+@router.callback_query(F.data.startswith("catpg_"))
+async def show_category_page(callback: CallbackQuery):
+    _, page, category = callback.data.split("_", 2)
+    await callback.message.edit_reply_markup(reply_markup=kb.get_products_keyboard(category=category, page=int(page)))
+    await callback.answer()
+
+@router.callback_query(F.data == "noop")
+async def noop_callback(callback: CallbackQuery):
+    # Page counter button between prev/next
+    await callback.answer()
+
 @router.callback_query(F.data == "back_to_cats")
 async def back_to_cats(callback: CallbackQuery):
     await callback.message.edit_text("Bo'limni tanlang:", reply_markup=kb.get_categories_keyboard())
@@ -80,24 +109,26 @@ async def start_search(message: Message, state: FSMContext):
 async def process_search(message: Message, state: FSMContext):
     query = message.text.lower()
     log_search(query) # Log analytics
-    products = load_products()
-    results = {}
-    
-    for pid, p in products.items():
-        if query in p['name'].lower() or query in p.get('description', '').lower():
-            results[pid] = p
+    results = search_products(query)
             
     if not results:
         await message.answer("😔 Hech narsa topilmadi. Boshqa nom bilan izlab ko'ring yoki bo'limlardan qidiring.", reply_markup=kb.main_menu)
     else:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        for pid, p in results.items():
-            button = InlineKeyboardButton(text=f"{p['name']} - {p['price']} so'm", callback_data=f"prod_{pid}")
-            keyboard.inline_keyboard.append([button])
-        
-        await message.answer(f"🔎 Qidiruv natijalari ({len(results)} ta):", reply_markup=keyboard)
+        await message.answer(f"🔎 Qidiruv natijalari ({len(results)} ta):", reply_markup=kb.get_search_results_keyboard(results))
     
     await state.clear()
+    # Kept after clear() so the result pages can be flipped
+    await state.update_data(search_query=query)
+
+@router.callback_query(F.data.startswith("srchpg_"))
+async def show_search_page(callback: CallbackQuery, state: FSMContext):
+    page = int(callback.data.split("_")[1])
+    query = (await state.get_data()).get("search_query")
+    if query is None:
+        await callback.answer("Qidiruvni qaytadan boshlang.", show_alert=True)
+        return
+    await callback.message.edit_reply_markup(reply_markup=kb.get_search_results_keyboard(search_products(query), page))
+    await callback.answer()
 
 @router.message(F.text == "📞 Biz bilan aloqa")
 async def show_contact(message: Message):
@@ -107,32 +138,35 @@ async def show_contact(message: Message):
 async def show_channel(message: Message):
     await message.answer("Bizning rasmiy kanalimizga obuna bo'ling:\nhttps://t.me/Niholbooks_online")
 
+async def send_product(message: Message, product_id):
+    """Sends the product card to message's chat; False if there is no such product."""
+    product = get_product(product_id)
+    if not product:
+        return False
+
+    text = kb.get_product_caption(product_id)
+    # Try to send photo, fallback to text if fail
+    try:
+        image_source = product['image']
+        send = lambda photo: message.answer_photo(photo=photo, caption=text, reply_markup=kb.get_buy_keyboard(product_id))
+        if image_source.startswith("http"):
+            # URL - pass as is
+            await send(image_source)
+        elif os.path.exists(image_source):
+            # Local file, optimized and uploaded once, then sent by file_id
+            await media_cache.send_photo(send, await fileio.run(images.optimize, image_source))
+        else:
+            # Assume Telegram File ID - pass as is
+            await send(image_source)
+    except Exception as e:
+         # await message.answer(f"Rasm yuborishda xatolik: {e}") # Debug
+         await message.answer(text, reply_markup=kb.get_buy_keyboard(product_id))
+    return True
+
 @router.callback_query(F.data.startswith("prod_"))
 async def show_product_detail(callback: CallbackQuery):
     product_id = int(callback.data.split("_")[1])
-    product = load_products().get(product_id)
-    
-    if product:
-        # Just text for now, can add photo if valid URL
-        text = f"<b>{product['name']}</b>\n\n{product['description']}\n\nNarxi: {product['price']} so'm"
-        # Try to send photo, fallback to text if fail
-        try:
-            image_source = product['image']
-            if image_source.startswith("http"):
-                # URL - pass as is
-                pass
-            elif os.path.exists(image_source):
-                # Local file
-                image_source = FSInputFile(image_source)
-            else:
-                # Assume Telegram File ID - pass as is
-                pass
-            
-            await callback.message.answer_photo(photo=image_source, caption=text, reply_markup=kb.get_buy_keyboard(product_id))
-        except Exception as e:
-             # await callback.message.answer(f"Rasm yuborishda xatolik: {e}") # Debug
-             await callback.message.answer(text, reply_markup=kb.get_buy_keyboard(product_id))
-    
+    await send_product(callback.message, product_id)
     await callback.answer()
 
 @router.callback_query(F.data == "back_to_list")
@@ -140,49 +174,134 @@ async def back_to_list(callback: CallbackQuery):
     await callback.message.delete()
     await callback.message.answer("Bizning kitoblar:", reply_markup=kb.get_products_keyboard())
 
+@router.callback_query(F.data.startswith("allpg_"))
+async def show_all_products_page(callback: CallbackQuery):
+    page = int(callback.data.split("_")[1])
+    await callback.message.edit_reply_markup(reply_markup=kb.get_products_keyboard(page=page))
+    await callback.answer()
+
+# --- INLINE SEARCH ---
+# Works in any chat as "@bot <title>" (inline mode must be enabled in
+# @BotFather). Each keystroke is a prefix-index lookup (search.PrefixIndex),
+# Telegram caches the answers for INLINE_CACHE_TIME, and further pages are
+# fetched with next_offset as the user scrolls.
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 300
+# What a Telegram file_id looks like; anything else (e.g. an imported path to
+# a file that isn't on this machine) is shown as a text result
+FILE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{20,}$")
+
+def inline_result(product_id, bot_username, photos=True):
+    product = get_product(product_id)
+    caption = kb.get_product_caption(product_id)
+    description = f"{product['price']} so'm · {product.get('category', '')}"
+    open_kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text="🛒 Botda ochish", url=f"https://t.me/{bot_username}?start=book_{product_id}")]])
+    image = product.get('image', "") if photos else ""
+    if image.startswith("http"):
+        return InlineQueryResultPhoto(id=str(product_id), photo_url=image, thumbnail_url=image,
+                                      title=product['name'], description=description,
+                                      caption=caption, reply_markup=open_kb)
+    if FILE_ID_RE.match(image) and not os.path.exists(image):
+        return InlineQueryResultCachedPhoto(id=str(product_id), photo_file_id=image,
+                                            title=product['name'], description=description,
+                                            caption=caption, reply_markup=open_kb)
+    return InlineQueryResultArticle(id=str(product_id), title=product['name'], description=description,
+                                    input_message_content=InputTextMessageContent(message_text=caption),
+                                    reply_markup=open_kb)
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery, bot: Bot):
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    product_ids = suggest_products(inline_query.query)
+    page = product_ids[offset:offset + INLINE_PAGE_SIZE]
+    bot_username = (await bot.me()).username
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(product_ids) else ""
+    try:
+        results = [inline_result(pid, bot_username) for pid in page]
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+    except TelegramBadRequest:
+        # One bad photo (a stale file_id, an unreachable URL) fails the whole
+        # answer; the page is still worth showing as text
+        results = [inline_result(pid, bot_username, photos=False) for pid in page]
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+
+# --- ORDER HISTORY ---
+ORDER_STATUS_LABELS = {
+    "new": "⏳ Ko'rib chiqilmoqda",
+    "accepted": "✅ Tasdiqlangan",
+    "rejected": "❌ Bekor qilingan",
+}
+
+@router.message(Command("orders"))
+async def show_my_orders(message: Message):
+    orders = await storage.get_user_orders(message.from_user.id)
+    if not orders:
+        await message.answer("Sizda hali buyurtmalar yo'q.")
+        return
+
+    text = "📦 <b>Oxirgi buyurtmalaringiz:</b>\n\n"
+    for order in orders:
+        books = ", ".join(f"{item['name']} × {item.get('quantity', 1)}" for item in order["items"])
+        text += (f"#{order['order_id']} ({order['created_at']})\n"
+                 f"📚 {books}\n"
+                 f"💰 {order['total']} so'm - {ORDER_STATUS_LABELS.get(order['status'], order['status'])}\n\n")
+    await message.answer(text)
+
 # --- CART SYSTEM ---
 @router.callback_query(F.data.startswith("add_cart_"))
 async def add_item_to_cart(callback: CallbackQuery):
     product_id = int(callback.data.split("_")[2])
-    add_to_cart(callback.from_user.id, product_id)
+    await storage.add_to_cart(callback.from_user.id, product_id)
     await callback.answer("✅ Savatga qo'shildi!", show_alert=True)
 
+def get_cart_text(cart):
+    # One catalog lookup per distinct book; the total is the cart's cached subtotal
+    products = load_products()
+    text = "🛒 <b>Sizning savatingiz:</b>\n\n"
+    for pid, quantity in cart["items"].items():
+        product = products.get(pid)
+        if product:
+            text += f"➖ {product['name']} - {quantity} × {product['price']} = {quantity * product['price']} so'm\n"
+    text += f"\n<b>Jami: {cart['subtotal']} so'm</b>"
+    return text
+
 @router.message(F.text == "🛒 Savat")
 async def show_cart(message: Message):
-    cart_ids = get_cart(message.from_user.id)
-    if not cart_ids:
+    cart = await storage.get_cart(message.from_user.id)
+    if not cart["items"]:
         await message.answer("Savatingiz bo'sh 🗑")
         return
 
-    products = load_products()
-    text = "🛒 <b>Sizning savatingiz:</b>\n\n"
-    total_price = 0
-    
-    for pid in cart_ids:
-        product = products.get(pid) # Ensure int if key is int, or str if str. JSON keys are str.
-        if not product:
-            product = products.get(str(pid))
-        
-        if product:
-            text += f"➖ {product['name']} - {product['price']} so'm\n"
-            total_price += product['price']
-            
-    text += f"\n<b>Jami: {total_price} so'm</b>"
-    
-    await message.answer(text, reply_markup=kb.get_cart_keyboard(len(cart_ids)))
+    await message.answer(get_cart_text(cart), reply_markup=kb.get_cart_keyboard(cart["items"]))
+
+@router.callback_query(F.data.startswith("cartinc_") | F.data.startswith("cartdec_"))
+async def change_cart_quantity(callback: CallbackQuery):
+    action, product_id = callback.data.split("_")
+    product_id = int(product_id)
+    if action == "cartinc":
+        await storage.add_to_cart(callback.from_user.id, product_id)
+    else:
+        await storage.remove_from_cart(callback.from_user.id, product_id)
+
+    cart = await storage.get_cart(callback.from_user.id)
+    if not cart["items"]:
+        await callback.message.edit_text("Savatingiz bo'sh 🗑")
+    else:
+        await callback.message.edit_text(get_cart_text(cart), reply_markup=kb.get_cart_keyboard(cart["items"]))
+    await callback.answer()
 
 @router.callback_query(F.data == "clear_cart")
 async def process_clear_cart(callback: CallbackQuery):
-    clear_cart(callback.from_user.id)
+    await storage.clear_cart(callback.from_user.id)
     await callback.message.edit_text("Savatingiz tozalandi 🗑")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("buy_"))
 async def start_buy_process(callback: CallbackQuery, state: FSMContext):
     product_id = int(callback.data.split("_")[1])
-    # "Buy Now" means buying ONLY this item. So clear cart and add this.
-    clear_cart(callback.from_user.id)
-    add_to_cart(callback.from_user.id, product_id)
+    # "Buy Now" means buying ONLY this item: the cart becomes just this book, in one transaction
+    await storage.replace_cart(callback.from_user.id, {product_id: 1})
     
     await state.set_state(OrderState.waiting_for_phone)
     await callback.message.answer("Bog'lanish uchun telefon raqamingizni yozing:\n(Masalan: +998901234567)")
@@ -221,30 +340,30 @@ async def process_shipping(callback: CallbackQuery, state: FSMContext, bot: Bot)
     address = data.get("address")
     
     # Calculate Total based on Cart
-    cart_ids = get_cart(callback.from_user.id)
-    if not cart_ids:
+    cart = await storage.get_cart(callback.from_user.id)
+    if not cart["items"]:
         await callback.message.answer("Xatolik: Savatingiz bo'shab qoldi.")
         await state.clear()
         return
 
     products_db = load_products() # Renamed to avoid confusion
     order_items_text = ""
-    total_price = 0
+    items = []
     
-    for pid in cart_ids:
-        p = products_db.get(str(pid)) or products_db.get(int(pid))
+    for pid, quantity in cart["items"].items():
+        p = products_db.get(pid)
         if p:
-            order_items_text += f"- {p['name']} ({p['price']} so'm)\n"
-            total_price += p['price']
+            order_items_text += f"- {p['name']} × {quantity} ({p['price']} so'm)\n"
+            # Snapshot, later catalog edits don't change the order
+            items.append({"product_id": pid, "name": p['name'], "price": p['price'], "quantity": quantity})
             
-    # Add shipping
-    total_with_shipping = total_price + int(shipping_price)
-    
     # Log Order Analytics
-    log_order(cart_ids)
+    log_order(cart["items"])
     
-    # Generate Order ID
+    # Generate Order ID and store the order in the ledger
     order_id = str(uuid.uuid4())[:8]
+    order = await storage.create_order(order_id, callback.from_user.id, items, shipping_name, shipping_price, phone, address)
+    total_with_shipping = order["total"]
     
     # Notify Admin (Personal)
     if config.ADMIN_IDS:
@@ -262,11 +381,7 @@ async def process_shipping(callback: CallbackQuery, state: FSMContext, bot: Bot)
              InlineKeyboardButton(text="❌ Bekor qilish", callback_data=f"status_reject_{callback.from_user.id}_{order_id}")]
         ])
         
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await bot.send_message(chat_id=admin_id, text=admin_text, reply_markup=admin_kb)
-            except Exception as e:
-                pass
+        notify_admins_background(lambda admin_id: bot.send_message(chat_id=admin_id, text=admin_text, reply_markup=admin_kb))
     
     # Confirmation and Payment Info
     await callback.message.delete()
@@ -281,7 +396,7 @@ async def process_shipping(callback: CallbackQuery, state: FSMContext, bot: Bot)
         f"Tez orada aloqaga chiqamiz."
     )
     # Clear cart after order
-    clear_cart(callback.from_user.id)
+    await storage.clear_cart(callback.from_user.id)
     
     # Wait for Receipt
     await state.update_data(order_id=order_id)
@@ -293,18 +408,17 @@ async def process_receipt(message: Message, state: FSMContext, bot: Bot):
     data = await state.get_data()
     order_id = data.get("order_id", "Unknown")
     
-    # Notify Admin
-    if config.ADMIN_IDS:
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await bot.send_message(chat_id=admin_id, text=f"📥 <b>Chek yuborildi!</b>\nBuyurtma ID: #{order_id}\nXaridor: {message.from_user.full_name}")
-                await message.send_copy(chat_id=admin_id)
-            except Exception:
-                pass
-                
     await message.answer("✅ Chek qabul qilindi! Adminlar tez orada tekshirib tasdiqlashadi.")
     await state.clear()
 
+    # Notify Admin
+    async def send_receipt(admin_id):
+        await bot.send_message(chat_id=admin_id, text=f"📥 <b>Chek yuborildi!</b>\nBuyurtma ID: #{order_id}\nXaridor: {message.from_user.full_name}")
+        await message.send_copy(chat_id=admin_id)
+
+    if config.ADMIN_IDS:
+        notify_admins_background(send_receipt)
+
 # --- FEEDBACK SYSTEM ---
 @router.message(F.text == "✍️ Fikr qoldirish")
 async def start_feedback(message: Message, state: FSMContext):
@@ -313,14 +427,13 @@ async def start_feedback(message: Message, state: FSMContext):
 
 @router.message(FeedbackState.waiting_for_text)
 async def process_feedback(message: Message, state: FSMContext, bot: Bot):
-    # Notify all admins
-    if config.ADMIN_IDS:
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await bot.send_message(chat_id=admin_id, text=f"📩 <b>Yangi Fikr-mulohaza!</b>\n👤 Kimdan: {message.from_user.full_name} (@{message.from_user.username})")
-                await message.send_copy(chat_id=admin_id)
-            except Exception:
-                pass
-    
     await message.answer("✅ Fikringiz uchun rahmat! Bu biz uchun muhim.")
     await state.clear()
+
+    # Notify all admins
+    async def send_feedback(admin_id):
+        await bot.send_message(chat_id=admin_id, text=f"📩 <b>Yangi Fikr-mulohaza!</b>\n👤 Kimdan: {message.from_user.full_name} (@{message.from_user.username})")
+        await message.send_copy(chat_id=admin_id)
+
+    if config.ADMIN_IDS:
+        notify_admins_background(send_feedback)
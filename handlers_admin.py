@@ -3,9 +3,18 @@ from aiogram.types import Message, CallbackQuery, PhotoSize, InlineKeyboardMarku
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from products import save_product, get_next_id, load_products, delete_product
-from users_db import get_all_users
-from analytics import export_stats
+from products import load_products
+import html
+import os
+import tempfile
+import storage
+import orders_db
+import broadcast
+import keyboards as kb
+import reports
+import metrics
+import catalog_io
+import fileio
 from aiogram.types import FSInputFile
 import config
 
@@ -34,9 +43,12 @@ async def cmd_admin(message: Message):
         "Admin Panelga xush kelibsiz!\n\n"
         "Quyidagi bo'limlardan birini tanlang:\n"
         "➕ <b>Yangi kitob qo'shish</b> - (/add_product)\n"
+        "📥 <b>Ro'yxatdan yuklash (CSV/XLSX)</b> - (/import)\n"
+        "📤 <b>Katalogni yuklab olish</b> - (/export, /export xlsx)\n"
         "✏️ <b>Tahrirlash</b> - (/edit_product)\n"
         "❌ <b>O'chirish</b> - (/delete_product)\n"
-        "📊 <b>Statistika</b> - (/stats)",
+        "📊 <b>Statistika</b> - (/stats)\n"
+        "📈 <b>Metrikalar</b> - (/metrics)",
         reply_markup=kb
     )
 
@@ -96,7 +108,6 @@ async def process_description(message: Message, state: FSMContext):
     description = message.text
     data = await state.get_data()
     
-    new_id = get_next_id()
     product_data = {
         "name": data['name'],
         "category": data.get('category', 'Boshqa'),
@@ -105,11 +116,84 @@ async def process_description(message: Message, state: FSMContext):
         "image": data['photo'] # Uses Telegram File ID
     }
     
-    save_product(new_id, product_data)
+    await storage.add_product(product_data)
     
     await message.answer(f"✅ Kitob qo'shildi!\nNomi: {data['name']}\nNarxi: {data['price']}")
     await state.clear()
 
+# --- BULK IMPORT / EXPORT ---
+IMPORT_ERRORS_SHOWN = 20
+
+class ImportState(StatesGroup):
+    waiting_for_file = State()
+
+@admin_router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    if str(message.from_user.id) not in config.ADMIN_IDS:
+        return
+
+    await state.set_state(ImportState.waiting_for_file)
+    await message.answer(
+        "Kitoblar ro'yxatini CSV yoki XLSX fayl qilib yuboring.\n"
+        "Ustunlar: <code>id, name, category, price, description, image</code>\n"
+        "id bo'sh bo'lsa yangi kitob qo'shiladi, mavjud id esa yangilanadi "
+        "(faqat faylda bor ustunlar o'zgaradi, masalan <code>id, name, price</code>). "
+        "/export fayli ham shu formatda."
+    )
+
+@admin_router.message(ImportState.waiting_for_file, F.document)
+async def process_import_file(message: Message, state: FSMContext, bot: Bot):
+    extension = os.path.splitext(message.document.file_name or "")[1].lower()
+    if extension not in (".csv", ".xlsx"):
+        await message.answer("Iltimos, .csv yoki .xlsx fayl yuboring.")
+        return
+    await state.clear()
+    await message.answer("Fayl tekshirilmoqda... ⏳")
+
+    fd, path = tempfile.mkstemp(prefix="import-", suffix=extension)
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        # Rows are validated as they are read; valid ones are committed in one write
+        result = await fileio.run(catalog_io.read_catalog_file, path)
+    except Exception as e:
+        await message.answer(f"Faylni o'qib bo'lmadi: {html.escape(str(e), quote=False)}")
+        return
+    finally:
+        await fileio.run(catalog_io.remove_file, path)
+
+    added, updated = [], []
+    if result.products:
+        added, updated = await storage.import_products(result.products, catalog_io.NEW_PRODUCT)
+
+    text = (f"📥 <b>Import tugadi</b> ({result.rows} qator)\n"
+            f"✅ Qo'shildi: {len(added)}\n"
+            f"✏️ Yangilandi: {len(updated)}\n"
+            f"❌ Xato: {result.error_count}")
+    if result.errors:
+        text += "\n\n" + "\n".join(f"{row}-qator: {html.escape(error[:100], quote=False)}"
+                                     for row, error in result.errors[:IMPORT_ERRORS_SHOWN])
+        if result.error_count > IMPORT_ERRORS_SHOWN:
+            text += f"\n... va yana {result.error_count - IMPORT_ERRORS_SHOWN} ta"
+    await message.answer(text)
+
+@admin_router.message(Command("export"))
+async def cmd_export(message: Message):
+    if str(message.from_user.id) not in config.ADMIN_IDS:
+        return
+
+    extension = ".xlsx" if "xlsx" in message.text.lower() else ".csv"
+    # Product dicts are replaced, never changed in place, so a shallow copy is a stable snapshot
+    catalog = dict(load_products())
+    fd, path = tempfile.mkstemp(prefix="catalog-", suffix=extension)
+    os.close(fd)
+    try:
+        await fileio.run(catalog_io.export_catalog, catalog, path)
+        await message.answer_document(FSInputFile(path, filename=f"kitoblar{extension}"),
+                                      caption=f"📤 Katalog: {len(catalog)} ta kitob")
+    finally:
+        await fileio.run(catalog_io.remove_file, path)
+
 # --- DELETE PRODUCT ---
 @admin_router.message(F.text == "❌ O'chirish")
 @admin_router.message(Command("delete_product"))
@@ -122,17 +206,18 @@ async def cmd_delete_product(message: Message):
         await message.answer("O'chirish uchun mahsulot yo'q.")
         return
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    for pid, p in products.items():
-        btn = InlineKeyboardButton(text=f"❌ {p['name']}", callback_data=f"del_{pid}")
-        keyboard.inline_keyboard.append([btn])
-    
-    await message.answer("O'chirmoqchi bo'lgan kitobni tanlang:", reply_markup=keyboard)
+    await message.answer("O'chirmoqchi bo'lgan kitobni tanlang:", reply_markup=kb.get_admin_products_keyboard("del"))
+
+@admin_router.callback_query(F.data.startswith("delpg_"))
+async def show_delete_page(callback: CallbackQuery):
+    page = int(callback.data.split("_")[1])
+    await callback.message.edit_reply_markup(reply_markup=kb.get_admin_products_keyboard("del", page))
+    await callback.answer()
 
 @admin_router.callback_query(F.data.startswith("del_"))
 async def process_delete_product(callback: CallbackQuery):
     pid = int(callback.data.split("_")[1])
-    if delete_product(pid):
+    if await storage.delete_product(pid):
         await callback.message.answer("✅ Mahsulot o'chirildi.")
         await callback.message.delete()
     else:
@@ -154,12 +239,13 @@ async def cmd_edit_product(message: Message):
         await message.answer("O'zgartirish uchun mahsulot yo'q.")
         return
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    for pid, p in products.items():
-        btn = InlineKeyboardButton(text=f"✏️ {p['name']}", callback_data=f"edit_{pid}")
-        keyboard.inline_keyboard.append([btn])
-    
-    await message.answer("O'zgartirmoqchi bo'lgan kitobni tanlang:", reply_markup=keyboard)
+    await message.answer("O'zgartirmoqchi bo'lgan kitobni tanlang:", reply_markup=kb.get_admin_products_keyboard("edit"))
+
+@admin_router.callback_query(F.data.startswith("editpg_"))
+async def show_edit_page(callback: CallbackQuery):
+    page = int(callback.data.split("_")[1])
+    await callback.message.edit_reply_markup(reply_markup=kb.get_admin_products_keyboard("edit", page))
+    await callback.answer()
 
 @admin_router.callback_query(F.data.startswith("edit_"))
 # Handle initial edit selection (edit_1) AND field selection (edit_field_1_price)
@@ -215,11 +301,8 @@ async def process_new_value(message: Message, state: FSMContext):
     else:
         new_value = message.text
 
-    # Update logic
-    products = load_products()
-    if pid in products:
-        products[pid][field] = new_value
-        save_product(pid, products[pid])
+    # Read-modify-write of the product as one unit of work in the catalog writer
+    if await storage.update_product(pid, {field: new_value}):
         await message.answer("✅ O'zgartirildi!")
     else:
         await message.answer("⚠️ Xatolik: Mahsulot topilmadi.")
@@ -242,21 +325,13 @@ async def cmd_broadcast(message: Message, state: FSMContext):
 
 @admin_router.message(BroadcastState.waiting_for_message)
 async def process_broadcast(message: Message, state: FSMContext, bot: Bot):
-    users = get_all_users()
-    count = 0
-    blocked = 0
-    
-    await message.answer(f"Xabar yuborish boshlandi... ({len(users)} ta foydalanuvchi)")
-    
-    for user_id in users:
-        try:
-            # Copy the message to preserve formatting, photos, etc.
-            await message.send_copy(chat_id=user_id)
-            count += 1
-        except Exception:
-            blocked += 1
-    
-    await message.answer(f"✅ Reklama yuborildi!\n\nQabul qildi: {count} ta\nBloklagan/Xato: {blocked} ta")
+    if broadcast.is_running():
+        await message.answer("⏳ Oldingi reklama hali yuborilmoqda. Tugashini kuting.")
+        await state.clear()
+        return
+
+    # Runs in the background; progress and the final report are sent to the admin
+    await broadcast.start(bot, message)
     await state.clear()
     
     # Show Admin Menu again
@@ -270,11 +345,19 @@ async def cmd_stats(message: Message):
         
     await message.answer("Statistika yuklanmoqda... ⏳")
     try:
-        file_path = export_stats()
+        # Generated in a worker process and cached until new events arrive
+        file_path = await reports.get_stats_report()
         await message.answer_document(FSInputFile(file_path), caption="📊 Savdo va Qidiruv statistikasi")
     except Exception as e:
         await message.answer(f"Xatolik yuz berdi: {e}")
 
+@admin_router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    if str(message.from_user.id) not in config.ADMIN_IDS:
+        return
+    # Handler and store latencies since the start; the full set is on the HTTP endpoint
+    await message.answer(metrics.summary())
+
 # --- ORDER STATUS HANDLING ---
 @admin_router.callback_query(F.data.startswith("status_"))
 async def process_order_status(callback: CallbackQuery, bot: Bot):
@@ -282,6 +365,16 @@ async def process_order_status(callback: CallbackQuery, bot: Bot):
     action = parts[1] # accept or reject
     user_id = parts[2]
     order_id = parts[3]
+
+    # Compare-and-set in the ledger: only the first click changes the status
+    # and notifies the customer, repeated or concurrent clicks are no-ops.
+    order = await storage.get_order(order_id)
+    if order is not None:
+        user_id = order["user_id"]
+        new_status = orders_db.STATUS_ACCEPTED if action == "accept" else orders_db.STATUS_REJECTED
+        if not await storage.set_order_status(order_id, new_status):
+            await callback.answer("Bu buyurtma allaqachon ko'rib chiqilgan.", show_alert=True)
+            return
     
     if action == "accept":
         try:
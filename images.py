@@ -0,0 +1,119 @@
+import logging
+import os
+import sys
+import threading
+import fileio
+import media_cache
+import products
+
+# Local images are re-encoded once into a Telegram-sized variant: at most
+# MAX_DIMENSION px on the long side, progressive JPEG (or WebP) at QUALITY,
+# with EXIF and other metadata dropped. Variants are stored in VARIANTS_DIR
+# under the source's content hash, so an edited image gets a new variant and
+# an unchanged one is never re-encoded. Pillow is optional: without it the
+# original file is used.
+VARIANTS_DIR = "image_cache"
+MAX_DIMENSION = 1280
+QUALITY = 82
+FORMAT = "JPEG"
+BRANDING_IMAGES = ["logo.jpg", "main_image.jpg", "nihol_books_logo.jpg", "tafsiri_hilol.jpg"]
+
+_memo = {}
+_lock = threading.Lock()
+_warned = False
+
+def _variant_path(content_hash):
+    extension = "webp" if FORMAT == "WEBP" else "jpg"
+    return os.path.join(VARIANTS_DIR, f"{content_hash[:16]}-{MAX_DIMENSION}-{QUALITY}.{extension}")
+
+def _encode(source, target):
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+        os.makedirs(VARIANTS_DIR, exist_ok=True)
+        # Per process: several workers may encode the same image at once
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        if FORMAT == "WEBP":
+            image.save(tmp_path, "WEBP", quality=QUALITY, method=6)
+        else:
+            image.save(tmp_path, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, target)
+
+def optimize(path):
+    """Returns the path to send for the local image at path.
+
+    That is the optimized variant, or the original if the variant would not
+    be smaller or Pillow is not installed. Blocking, run it on the fileio pool.
+    """
+    global _warned
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    fingerprint = (stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        memo = _memo.get(path)
+        if memo is not None and memo[0] == fingerprint:
+            return memo[1]
+
+        target = _variant_path(media_cache.file_hash(path))
+        if not os.path.exists(target):
+            try:
+                _encode(path, target)
+            except ImportError:
+                if not _warned:
+                    logging.warning("Pillow is not installed, sending images unoptimized")
+                    _warned = True
+                return path
+            except Exception:
+                logging.exception("Could not optimize %s", path)
+                return path
+
+        result = target if os.path.getsize(target) < stat.st_size else path
+        _memo[path] = (fingerprint, result)
+        return result
+
+def _is_local_image(image):
+    return bool(image) and not image.startswith("http") and os.path.exists(image)
+
+def _on_catalog_change(product_id, product):
+    # On ingest: prepare the variant of a new local product image in the background
+    if product is not None and _is_local_image(product.get("image")):
+        fileio.submit(optimize, product["image"])
+
+products.add_listener(_on_catalog_change)
+
+def local_images():
+    paths = [path for path in BRANDING_IMAGES if os.path.exists(path)]
+    for product in products.load_products().values():
+        image = product.get("image", "")
+        if _is_local_image(image) and image not in paths:
+            paths.append(image)
+    return paths
+
+def optimize_all():
+    """Optimizes every local catalog and branding image.
+
+    Returns a list of (path, original bytes, sent bytes).
+    """
+    report = []
+    for path in local_images():
+        result = optimize(path)
+        report.append((path, os.path.getsize(path), os.path.getsize(result)))
+    return report
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        MAX_DIMENSION = int(sys.argv[1])
+    total_before = total_after = 0
+    for path, before, after in optimize_all():
+        total_before += before
+        total_after += after
+        print(f"{path:<40} {before / 1024:8.1f} KB -> {after / 1024:8.1f} KB")
+    saved = total_before - total_after
+    print(f"Total: {total_before / 1024:.1f} KB -> {total_after / 1024:.1f} KB, "
+          f"saved {saved / 1024:.1f} KB ({saved * 100 / max(total_before, 1):.0f}%)")
@@ -1,5 +1,5 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from products import load_products
+from products import load_products, get_product, get_version, add_listener
 
 # Main Menu
 main_menu = ReplyKeyboardMarkup(
@@ -11,36 +11,173 @@ main_menu = ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
+# Render cache. The category -> product ids index is built once from the
+# catalog and then updated incrementally through products.add_listener, and
+# the built keyboards and captions are kept until the products they show
+# change, so browsing never scans the catalog.
+#
+# Product lists are paginated: _list_cache holds, per category (None for the
+# whole catalog), the ordered product ids and the pages built so far, and
+# only the requested page slice is ever built.
+PAGE_SIZE = 10
+
+_category_index = {}
+_product_category = {}
+_index_ready = False
+_keyboard_cache = {}
+_list_cache = {}
+_caption_cache = {}
+
+def _category_of(product):
+    return product.get("category", "Boshqa")
+
+def _index_add(product_id, product):
+    category = _category_of(product)
+    if category not in _category_index:
+        _keyboard_cache.pop("categories", None)
+    _category_index.setdefault(category, {})[product_id] = None
+    _product_category[product_id] = category
+
+def _index_remove(product_id):
+    category = _product_category.pop(product_id, None)
+    ids = _category_index.get(category)
+    if ids is not None:
+        ids.pop(product_id, None)
+        if not ids:
+            del _category_index[category]
+            _keyboard_cache.pop("categories", None)
+    return category
+
+def _on_catalog_change(product_id, product):
+    global _index_ready
+    if product_id is None:
+        # Catalog reloaded from disk, start over
+        _index_ready = False
+        _keyboard_cache.clear()
+        _list_cache.clear()
+        _caption_cache.clear()
+        return
+    _caption_cache.pop(product_id, None)
+    _list_cache.pop(None, None)
+    if not _index_ready:
+        return
+    old_category = _product_category.get(product_id)
+    if product is None:
+        _index_remove(product_id)
+    elif old_category != _category_of(product):
+        _index_remove(product_id)
+        _index_add(product_id, product)
+    _list_cache.pop(old_category, None)
+    if product is not None:
+        _list_cache.pop(_category_of(product), None)
+
+add_listener(_on_catalog_change)
+
+def _ensure_index():
+    global _index_ready
+    products = load_products()
+    if not _index_ready:
+        _category_index.clear()
+        _product_category.clear()
+        for product_id, product in products.items():
+            _index_add(product_id, product)
+        _index_ready = True
+    return products
+
 # Function to get unique categories
 def get_categories_keyboard():
-    products = load_products()
-    categories = set()
-    for p in products.values():
-        categories.add(p.get("category", "Boshqa"))
-    
+    _ensure_index()
+    keyboard = _keyboard_cache.get("categories")
+    if keyboard is None:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+        for cat in sorted(_category_index):
+            keyboard.inline_keyboard.append([InlineKeyboardButton(text=f"📂 {cat}", callback_data=f"cat_{cat}")])
+        _keyboard_cache["categories"] = keyboard
+    return keyboard
+
+def page_count(total):
+    return max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+
+def build_page_keyboard(ids, page, make_button, page_data):
+    """Builds one page of a long list.
+
+    make_button(item) returns the button for an item and page_data(page)
+    the callback data of the prev/next buttons.
+    """
+    pages = page_count(len(ids))
+    page = min(max(page, 0), pages - 1)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    for cat in sorted(categories):
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text=f"📂 {cat}", callback_data=f"cat_{cat}")])
+    for item in ids[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+        keyboard.inline_keyboard.append([make_button(item)])
+
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(text="⬅️", callback_data=page_data(page - 1)))
+        nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton(text="➡️", callback_data=page_data(page + 1)))
+        keyboard.inline_keyboard.append(nav)
     return keyboard
 
+def product_button(product_id):
+    product = get_product(product_id)
+    return InlineKeyboardButton(text=f"{product['name']} - {product['price']} so'm", callback_data=f"prod_{product_id}")
+
+def _product_list(category):
+    products = _ensure_index()
+    entry = _list_cache.get(category)
+    if entry is None:
+        ids = _category_index.get(category, {}) if category else products
+        entry = {"ids": list(ids), "pages": {}}
+        _list_cache[category] = entry
+    return entry
+
+def get_product_ids(category=None):
+    # Ordered ids of a category (or the whole catalog), shared; don't modify
+    return _product_list(category)["ids"]
+
 # Function to generate product list buttons
-def get_products_keyboard(category=None):
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    products = load_products()
-    for product_id, product in products.items():
-        # Filter by category if provided
-        if category and product.get("category", "Boshqa") != category:
-            continue
-            
-        button = InlineKeyboardButton(text=f"{product['name']} - {product['price']} so'm", callback_data=f"prod_{product_id}")
-        keyboard.inline_keyboard.append([button])
-    
-    # Add back button if inside a category
+def get_products_keyboard(category=None, page=0):
+    entry = _product_list(category)
+    page = min(max(page, 0), page_count(len(entry["ids"])) - 1)
+    keyboard = entry["pages"].get(page)
+    if keyboard is not None:
+        return keyboard
+
     if category:
+        keyboard = build_page_keyboard(entry["ids"], page, product_button, lambda p: f"catpg_{p}_{category}")
+        # Add back button if inside a category
         keyboard.inline_keyboard.append([InlineKeyboardButton(text="🔙 Kategoriyalarga qaytish", callback_data="back_to_cats")])
-        
+    else:
+        keyboard = build_page_keyboard(entry["ids"], page, product_button, lambda p: f"allpg_{p}")
+
+    entry["pages"][page] = keyboard
     return keyboard
 
+def get_search_results_keyboard(results, page=0):
+    return build_page_keyboard(results, page, product_button, lambda p: f"srchpg_{p}")
+
+def get_admin_products_keyboard(action, page=0):
+    # Product picker for the admin edit/delete commands
+    icon = "❌" if action == "del" else "✏️"
+    return build_page_keyboard(
+        get_product_ids(), page,
+        lambda pid: InlineKeyboardButton(text=f"{icon} {get_product(pid)['name']}", callback_data=f"{action}_{pid}"),
+        lambda p: f"{action}pg_{p}",
+    )
+
+def get_product_caption(product_id):
+    get_version() # picks up a hand-edited products.json
+    caption = _caption_cache.get(product_id)
+    if caption is None:
+        product = get_product(product_id)
+        if product is None:
+            return None
+        caption = f"<b>{product['name']}</b>\n\n{product['description']}\n\nNarxi: {product['price']} so'm"
+        _caption_cache[product_id] = caption
+    return caption
+
 def get_shipping_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Uz Pochta - 15 000 so'm (1 kilogram uchun)", callback_data="ship_Uz Pochta_15000")],
@@ -64,9 +201,20 @@ def get_buy_keyboard(product_id):
         [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_list")]
     ])
 
-def get_cart_keyboard(cart_items_count):
+def get_cart_keyboard(items):
+    # items: {product_id: quantity}; one "➖ name ×n ➕" row per book
     kb = InlineKeyboardMarkup(inline_keyboard=[])
-    if cart_items_count > 0:
+    for pid, quantity in items.items():
+        product = get_product(pid)
+        if not product:
+            continue
+        name = product['name'] if len(product['name']) <= 24 else product['name'][:23] + "…"
+        kb.inline_keyboard.append([
+            InlineKeyboardButton(text="➖", callback_data=f"cartdec_{pid}"),
+            InlineKeyboardButton(text=f"{name} ×{quantity}", callback_data="noop"),
+            InlineKeyboardButton(text="➕", callback_data=f"cartinc_{pid}"),
+        ])
+    if items:
         kb.inline_keyboard.append([InlineKeyboardButton(text="💸 Buyurtma berish", callback_data="checkout")])
         kb.inline_keyboard.append([InlineKeyboardButton(text="🗑 Savatni tozalash", callback_data="clear_cart")])
     return kb
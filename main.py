@@ -3,36 +3,96 @@ import logging
 import sys
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 import config
+import cluster
+import cart_db
+import orders_db
+import analytics
+import broadcast
+import users_db
+import notify
+import storage
+import reports
+import fsm_storage
+import webhook
+import metrics
+import throttle
+import products
 from handlers import router
 from handlers_admin import admin_router
 
 async def start_bot(bot: Bot):
-    for admin_id in config.ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text="Bot ishga tushdi")
-        except:
-            pass
+    # One notice per bot, not per worker
+    if cluster.is_primary():
+        await notify.notify_admins(lambda admin_id: bot.send_message(admin_id, text="Bot ishga tushdi"))
 
 async def stop_bot(bot: Bot):
-    for admin_id in config.ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text="Bot to'xtadi")
-        except:
-            pass
+    # Queued order/receipt notifications go out before the goodbye
+    await notify.drain()
+    if cluster.is_primary():
+        await notify.notify_admins(lambda admin_id: bot.send_message(admin_id, text="Bot to'xtadi"))
 
-async def main():
-    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+def create_dispatcher():
+    """Opens the local stores and builds the dispatcher with all hooks and routers."""
+    # Open the cart database (migrates carts.json on first run) and the order ledger
+    cart_db.init_db()
+    orders_db.init_db()
+
+    # Conversations are stored on disk so in-progress orders survive a restart
+    fsm = fsm_storage.SQLiteStorage()
+    dp = Dispatcher(storage=fsm)
     
     dp.startup.register(start_bot)
+    # Logs how long the event loop gets blocked
+    dp.startup.register(storage.start_monitor)
+    dp.startup.register(fsm.start_sweeper)
+    dp.startup.register(analytics.start)
+    dp.startup.register(users_db.start)
+    # Single writer for products.json, flushed once more on shutdown
+    dp.startup.register(products.writer.start)
+    # Continue a broadcast interrupted by a restart (admins are on the primary)
+    if cluster.is_primary():
+        dp.startup.register(broadcast.resume)
     dp.shutdown.register(stop_bot)
+    # Flush buffered analytics events before exit
+    dp.shutdown.register(analytics.stop)
+    dp.shutdown.register(users_db.stop)
+    dp.shutdown.register(products.writer.stop)
+    dp.shutdown.register(reports.stop)
+    dp.shutdown.register(storage.stop_monitor)
+    dp.shutdown.register(fsm.close)
+    
+    # Per-user flood protection; installed first, so throttled updates
+    # don't count as handler time
+    throttle.install(admin_router, router)
+    # Latency and error metrics, served on METRICS_PORT and via /metrics
+    metrics.install(dp, admin_router, router)
+    dp.startup.register(metrics.start_server)
+    dp.shutdown.register(metrics.stop_server)
     
     dp.include_router(admin_router)
     dp.include_router(router)
+    return dp
+
+async def main():
+    if config.BOT_WORKERS > 1 and not cluster.enabled():
+        # Supervisor: starts the workers and feeds them updates
+        await cluster.run_supervisor()
+        return
+
+    dp = create_dispatcher()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.BOT_API_URL)) if config.BOT_API_URL else None
+    bot = Bot(token=config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     
-    await dp.start_polling(bot)
+    if cluster.enabled():
+        await cluster.run_worker(dp, bot)
+    elif config.BOT_MODE == "webhook":
+        await webhook.run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+import fileio
+
+CACHE_FILE = "media_cache.json"
+
+# Local images are uploaded to Telegram once; the returned file_id is kept
+# per path together with the file's content hash and reused afterwards.
+# The hash is only recomputed when the file's size or mtime changes, and a
+# changed hash means a new upload. A file_id Telegram no longer accepts is
+# dropped and the file is uploaded again.
+_entries = None
+_lock = threading.Lock()
+
+def _load():
+    global _entries
+    if _entries is None:
+        _entries = {}
+        if os.path.exists(CACHE_FILE):
+            try:
+                with open(CACHE_FILE, "r", encoding="utf-8") as f:
+                    _entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                _entries = {}
+    return _entries
+
+def _save():
+    fileio.atomic_write_json(CACHE_FILE, _entries, indent=4)
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def lookup(path):
+    """Returns the cached file_id for path, or None if it must be uploaded."""
+    with _lock:
+        entry = _load().get(path)
+        if entry is None:
+            return None
+        try:
+            size, mtime = _fingerprint(path)
+        except OSError:
+            return None
+        if (size, mtime) != (entry["size"], entry["mtime"]):
+            # Touched: only a different content hash invalidates the file_id
+            if file_hash(path) != entry["hash"]:
+                return None
+            entry["size"], entry["mtime"] = size, mtime
+            _save()
+        return entry["file_id"]
+
+def remember(path, file_id):
+    with _lock:
+        size, mtime = _fingerprint(path)
+        _load()[path] = {"file_id": file_id, "hash": file_hash(path), "size": size, "mtime": mtime}
+        _save()
+
+def forget(path):
+    with _lock:
+        if _load().pop(path, None) is not None:
+            _save()
+
+async def send_photo(send, path):
+    """Sends the local image at path, uploading it only when needed.
+
+    send(photo) performs the actual call, e.g.
+    lambda photo: message.answer_photo(photo, caption=...)
+    """
+    file_id = await fileio.run(lookup, path)
+    if file_id is not None:
+        try:
+            return await send(file_id)
+        except TelegramBadRequest as e:
+            logging.info("Cached file_id for %s rejected (%s), uploading again", path, e)
+            await fileio.run(forget, path)
+
+    message = await send(FSInputFile(path))
+    if message.photo:
+        await fileio.run(remember, path, message.photo[-1].file_id)
+    return message
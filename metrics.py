@@ -0,0 +1,229 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+
+# In-process metrics in the Prometheus text format. Latencies go into
+# fixed-bucket histograms, so memory stays constant however long the bot
+# runs; counters and gauges cover the rest. Store functions are wrapped with
+# @timed(store) and may run on the fileio pool, hence the lock.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UPDATE_SECONDS = "bot_update_duration_seconds"
+UPDATES = "bot_updates_total"
+UPDATE_ERRORS = "bot_update_errors_total"
+HANDLER_SECONDS = "bot_handler_duration_seconds"
+HANDLER_ERRORS = "bot_handler_errors_total"
+STORAGE_SECONDS = "bot_storage_duration_seconds"
+
+_descriptions = {}
+_histograms = {}
+_counters = {}
+_gauges = {}
+_lock = threading.Lock()
+_runner = None
+
+def describe(name, kind, help_text):
+    _descriptions[name] = (kind, help_text)
+
+describe(UPDATE_SECONDS, "histogram", "Time to process an update, by update type.")
+describe(UPDATES, "counter", "Updates processed, by update type and whether a handler took them.")
+describe(UPDATE_ERRORS, "counter", "Updates whose processing raised, by update type.")
+describe(HANDLER_SECONDS, "histogram", "Time spent in a handler, by handler.")
+describe(HANDLER_ERRORS, "counter", "Exceptions raised by a handler, by handler and exception type.")
+describe(STORAGE_SECONDS, "histogram", "Time spent in a store function, by store and function.")
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        key = _key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+def inc(name, value=1, **labels):
+    with _lock:
+        series = _counters.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + value
+
+def gauge(name, help_text, read):
+    """Registers a gauge whose value is read(), called at scrape time."""
+    describe(name, "gauge", help_text)
+    _gauges[name] = read
+
+def timed(store):
+    """Decorator recording the duration of a store function under STORAGE_SECONDS."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(STORAGE_SECONDS, time.perf_counter() - start, store=store, function=func.__name__)
+        return wrapper
+    return decorator
+
+# --- Middlewares ---
+
+async def update_middleware(handler, event, data):
+    # Outer middleware on the dispatcher: the whole update, all routers included
+    from aiogram.dispatcher.event.bases import UNHANDLED
+
+    update_type = event.event_type
+    start = time.perf_counter()
+    try:
+        result = await handler(event, data)
+    except Exception:
+        inc(UPDATE_ERRORS, update_type=update_type)
+        raise
+    finally:
+        observe(UPDATE_SECONDS, time.perf_counter() - start, update_type=update_type)
+    inc(UPDATES, update_type=update_type, handled="false" if result is UNHANDLED else "true")
+    return result
+
+async def handler_middleware(handler, event, data):
+    # Inner middleware: runs once filters have picked the handler
+    name = data["handler"].callback.__name__
+    start = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception as e:
+        inc(HANDLER_ERRORS, handler=name, exception=type(e).__name__)
+        raise
+    finally:
+        observe(HANDLER_SECONDS, time.perf_counter() - start, handler=name)
+
+def install(dp, *routers):
+    dp.update.outer_middleware(update_middleware)
+    for router in routers:
+        for observer in router.observers.values():
+            if observer.event_name not in ("update", "error"):
+                observer.middleware(handler_middleware)
+
+# --- Export ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = {name: {key: dict(h, buckets=list(h["buckets"])) for key, h in series.items()}
+                      for name, series in _histograms.items()}
+        counters = {name: dict(series) for name, series in _counters.items()}
+
+    for name in sorted(set(histograms) | set(counters) | set(_gauges)):
+        kind, help_text = _descriptions.get(name, ("untyped", ""))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if name in histograms:
+            for key, histogram in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+        elif name in counters:
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        else:
+            try:
+                lines.append(f"{name} {_gauges[name]()}")
+            except Exception:
+                logging.exception("Gauge %s failed", name)
+    return "\n".join(lines) + "\n"
+
+def quantile(histogram, q):
+    """Estimates a quantile from the buckets (linear within a bucket)."""
+    rank = q * histogram["count"]
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(BUCKETS, histogram["buckets"]):
+        if count and seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return BUCKETS[-1]
+
+def _top(name, label_names, limit):
+    with _lock:
+        series = [(dict(key), dict(h, buckets=list(h["buckets"]))) for key, h in _histograms.get(name, {}).items()]
+    series.sort(key=lambda item: -item[1]["sum"])
+    rows = []
+    for labels, histogram in series[:limit]:
+        label = ".".join(str(labels.get(label_name, "")) for label_name in label_names)
+        rows.append(f"<code>{label}</code>: {histogram['count']} ta, "
+                    f"p50 {quantile(histogram, 0.5) * 1000:.1f} ms, p99 {quantile(histogram, 0.99) * 1000:.1f} ms")
+    return rows
+
+def summary(limit=10):
+    """Short HTML summary for the admin /metrics command."""
+    with _lock:
+        update_errors = sum(_counters.get(UPDATE_ERRORS, {}).values())
+        handler_errors = dict(_counters.get(HANDLER_ERRORS, {}))
+        updates = sum(_counters.get(UPDATES, {}).values())
+    text = f"📈 <b>Metrikalar</b>\n\nUpdate'lar: {updates}, xatolar: {update_errors}\n"
+    text += "\n<b>Handlerlar (umumiy vaqt bo'yicha):</b>\n" + ("\n".join(_top(HANDLER_SECONDS, ["handler"], limit)) or "—")
+    text += "\n\n<b>Saqlash funksiyalari:</b>\n" + ("\n".join(_top(STORAGE_SECONDS, ["store", "function"], limit)) or "—")
+    if handler_errors:
+        text += "\n\n<b>Xatolar:</b>\n" + "\n".join(
+            f"<code>{dict(key)['handler']}</code> {dict(key)['exception']}: {count}"
+            for key, count in sorted(handler_errors.items(), key=lambda item: -item[1])[:limit])
+    return text
+
+# --- HTTP endpoint ---
+
+async def start_server():
+    """Serves /metrics on METRICS_HOST:METRICS_PORT (disabled when the port is 0)."""
+    global _runner
+    # Imported here (like UNHANDLED above): the store modules import this
+    # one, also in the report worker process, which needs neither
+    from aiohttp import web
+    import cluster
+    import config
+
+    async def serve(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    if not config.METRICS_PORT:
+        return
+    # One port per worker in multi-worker mode
+    port = config.METRICS_PORT + (cluster.worker_index() or 0)
+    app = web.Application()
+    app.router.add_get("/metrics", serve)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    try:
+        await web.TCPSite(_runner, config.METRICS_HOST, port).start()
+    except OSError as e:
+        logging.warning("Metrics endpoint not started: %s", e)
+        await _runner.cleanup()
+        _runner = None
+        return
+    logging.info("Metrics on http://%s:%s/metrics", config.METRICS_HOST, port)
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
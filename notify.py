@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import config
+
+# Messages to admins are sent to all of them concurrently, each with its own
+# timeout, so one slow or failing admin chat doesn't delay the others or the
+# customer. Failures are logged instead of silently dropped.
+ADMIN_TIMEOUT = 10
+
+_pending = set()
+
+async def _send_one(admin_id, send):
+    try:
+        await asyncio.wait_for(send(admin_id), timeout=ADMIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning("Admin notification to %s timed out", admin_id)
+    except Exception:
+        logging.exception("Admin notification to %s failed", admin_id)
+
+async def notify_admins(send):
+    """Runs send(admin_id) for every admin at once and waits for all of them.
+
+    send is a coroutine function, e.g.
+    lambda admin_id: bot.send_message(chat_id=admin_id, text=...)
+    """
+    await asyncio.gather(*(_send_one(admin_id, send) for admin_id in config.ADMIN_IDS))
+
+def notify_admins_background(send):
+    # Fire and forget, the handler can answer the customer right away
+    task = asyncio.create_task(notify_admins(send))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
+
+async def drain():
+    # On shutdown, let queued notifications finish
+    if _pending:
+        await asyncio.gather(*_pending, return_exceptions=True)
@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+import metrics
+
+ORDERS_DB = "orders.db"
+
+# Order ledger. Every checkout is stored with a snapshot of its items and
+# totals, indexed by order id (primary key), user id and creation time.
+# Status changes are compare-and-set: set_status only succeeds if the order
+# is still in the expected status, so two admins clicking at once can't
+# both accept (and notify the customer twice).
+STATUS_NEW = "new"
+STATUS_ACCEPTED = "accepted"
+STATUS_REJECTED = "rejected"
+
+_conn = None
+_lock = threading.Lock()
+
+_COLUMNS = ("order_id", "user_id", "created_at", "status", "phone", "address",
+            "shipping_name", "shipping_price", "items", "items_total", "total")
+
+def _connect():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(ORDERS_DB, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL,
+            phone TEXT,
+            address TEXT,
+            shipping_name TEXT,
+            shipping_price INTEGER,
+            items TEXT NOT NULL,
+            items_total INTEGER NOT NULL,
+            total INTEGER NOT NULL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS orders_created ON orders (created_at)")
+        _conn = conn
+    return _conn
+
+def init_db():
+    with _lock:
+        _connect()
+
+def _row_to_order(row):
+    if row is None:
+        return None
+    order = dict(zip(_COLUMNS, row))
+    order["items"] = json.loads(order["items"])
+    return order
+
+@metrics.timed("orders")
+def create_order(order_id, user_id, items, shipping_name, shipping_price, phone, address):
+    """Stores a new order.
+
+    items is a list of {"product_id", "name", "price", "quantity"} dicts, a
+    snapshot of the catalog at checkout time. Returns the stored order.
+    """
+    items_total = sum(item["price"] * item.get("quantity", 1) for item in items)
+    order = {
+        "order_id": order_id,
+        "user_id": int(user_id),
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "status": STATUS_NEW,
+        "phone": phone,
+        "address": address,
+        "shipping_name": shipping_name,
+        "shipping_price": int(shipping_price),
+        "items": items,
+        "items_total": items_total,
+        "total": items_total + int(shipping_price),
+    }
+    values = [json.dumps(order[c], ensure_ascii=False) if c == "items" else order[c] for c in _COLUMNS]
+    with _lock:
+        _connect().execute(f"INSERT INTO orders ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", values)
+    return order
+
+@metrics.timed("orders")
+def get_order(order_id):
+    with _lock:
+        row = _connect().execute(f"SELECT {', '.join(_COLUMNS)} FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    return _row_to_order(row)
+
+@metrics.timed("orders")
+def get_user_orders(user_id, limit=10):
+    # Newest first, served by the (user_id, created_at) index
+    with _lock:
+        rows = _connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (int(user_id), limit)).fetchall()
+    return [_row_to_order(row) for row in rows]
+
+@metrics.timed("orders")
+def get_orders_between(start, end):
+    """Orders created in [start, end), both "YYYY-MM-DD" or full timestamps."""
+    with _lock:
+        rows = _connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM orders WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+            (start, end)).fetchall()
+    return [_row_to_order(row) for row in rows]
+
+@metrics.timed("orders")
+def set_status(order_id, new_status, expected_status=STATUS_NEW):
+    """Moves an order from expected_status to new_status.
+
+    Returns True if this call changed it, False if the order is missing or
+    was already moved by someone else.
+    """
+    with _lock:
+        cursor = _connect().execute("UPDATE orders SET status = ? WHERE order_id = ? AND status = ?",
+                                    (new_status, order_id, expected_status))
+    return cursor.rowcount == 1
@@ -1,36 +1,246 @@
 import json
 import os
+import threading
+import cluster
+import fileio
+import metrics
+from store_writer import StoreWriter
 
 DB_FILE = "products.json"
+# Next free product id, kept next to the catalog so ids of deleted books are
+# never handed out again and a new id doesn't need a scan of the catalog
+ID_FILE = "product_ids.json"
 
-def load_products():
+# In-memory catalog cache. The file is parsed once and then kept in memory;
+# save_product/delete_product write through it, and a changed mtime (someone
+# edited products.json by hand) triggers a reload.
+#
+# Changes are applied to the cache and the file is written from a snapshot.
+# In the bot all changes go through `writer` (see store_writer.py), which
+# coalesces a burst of changes into one write on the I/O pool; the plain
+# save_product/delete_product write right away, for scripts. Snapshots older
+# than the last written one are skipped, and the mtime check is paused while
+# there are unwritten changes.
+#
+# _version only counts changes within this process. get_stamp() names the
+# catalog's contents across restarts: the file's mtime and size while the
+# cache matches the file, and a per-process tag while it has changes of its
+# own, so a stamp is never reused for different prices.
+_catalog = {}
+_mtime = None
+_stamp = None
+_stamp_version = 0
+_session = os.urandom(4).hex()
+_loaded = False
+_version = 0
+_listeners = []
+_write_lock = threading.Lock()
+_written_version = 0
+_pending_writes = 0
+_next_id = 1
+
+def _file_stat():
+    # (mtime, stamp) of products.json
+    try:
+        stat = os.stat(DB_FILE)
+    except OSError:
+        return None, "none"
+    return stat.st_mtime_ns, f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def _read_file():
     if not os.path.exists(DB_FILE):
         return {}
     with open(DB_FILE, "r", encoding="utf-8") as f:
         # JSON keys are strings, but our logic often uses ints for IDs.
-        # We'll load them as strings, but convert to int when needed.
         data = json.load(f)
         # Convert keys to int for the bot logic compatibility
         return {int(k): v for k, v in data.items()}
 
+def _read_next_id():
+    try:
+        with open(ID_FILE, "r", encoding="utf-8") as f:
+            return int(json.load(f)["next_id"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 1
+
+def take_snapshot():
+    """Returns (version, catalog copy, next id) for write_snapshot(), or None
+    if the file is up to date."""
+    global _pending_writes
+    if _version <= _written_version:
+        return None
+    with _write_lock:
+        _pending_writes += 1
+    return _version, dict(_catalog), _next_id
+
+@metrics.timed("products")
+def write_snapshot(snapshot):
+    global _mtime, _stamp, _stamp_version, _written_version, _pending_writes
+    version, catalog, next_id = snapshot
+    try:
+        with fileio.file_lock(DB_FILE):
+            if version <= _written_version:
+                return
+            fileio.atomic_write_json(DB_FILE, catalog, indent=4, ensure_ascii=False)
+            fileio.atomic_write_json(ID_FILE, {"next_id": next_id})
+            _written_version = version
+            _mtime, _stamp = _file_stat()
+            _stamp_version = version
+    finally:
+        with _write_lock:
+            _pending_writes -= 1
+
+def _notify(product_id, product):
+    for listener in _listeners:
+        listener(product_id, product)
+
+def _ensure_loaded():
+    global _catalog, _mtime, _stamp, _stamp_version, _loaded, _version, _written_version, _next_id
+    if _loaded and (_pending_writes or _version > _written_version):
+        return
+    mtime, stamp = _file_stat()
+    if _loaded and mtime == _mtime:
+        return
+    _catalog = _read_file()
+    # The only full scan for ids: ids added to the file by hand are respected
+    _next_id = max(_read_next_id(), max(_catalog, default=0) + 1)
+    _mtime = mtime
+    _loaded = True
+    _version += 1
+    _written_version = _version
+    _stamp = stamp
+    _stamp_version = _version
+    _notify(None, None)
+
+def add_listener(listener):
+    # listener(product_id, product) is called after every change:
+    # product is None for a delete, both are None for a full reload.
+    _listeners.append(listener)
+
+@metrics.timed("products")
+def load_products():
+    # Returns the shared cached dict; treat it as read-only and use
+    # save_product/delete_product for changes.
+    _ensure_loaded()
+    return _catalog
+
+@metrics.timed("products")
+def get_product(product_id):
+    _ensure_loaded()
+    return _catalog.get(int(product_id))
+
+def get_version():
+    # Bumped on every change to the catalog, used as a cache key elsewhere.
+    _ensure_loaded()
+    return _version
+
+def get_stamp():
+    """Names the current catalog contents; unlike get_version() it stays the
+    same across restarts, for caches kept on disk (the cart subtotals)."""
+    _ensure_loaded()
+    if _version == _stamp_version:
+        return _stamp
+    return f"{_stamp}/{_session}/{_version}"
+
+@metrics.timed("products")
+def reload_products():
+    global _loaded
+    _loaded = False
+    _ensure_loaded()
+
+# --- Changes to the cache; persisted by the next snapshot ---
+
+@metrics.timed("products")
+def set_product(product_id, data):
+    global _version, _next_id
+    _ensure_loaded()
+    _catalog[int(product_id)] = data
+    _next_id = max(_next_id, int(product_id) + 1)
+    _version += 1
+    _notify(int(product_id), data)
+
+@metrics.timed("products")
+def remove_product(product_id):
+    """Returns False if there was nothing to delete."""
+    global _version
+    _ensure_loaded()
+    product_id = int(product_id)
+    if product_id not in _catalog:
+        return False
+    del _catalog[product_id]
+    _version += 1
+    _notify(product_id, None)
+    return True
+
+def add_product(data):
+    """Stores a new product under the next free id and returns the id."""
+    product_id = get_next_id()
+    set_product(product_id, data)
+    return product_id
+
+@metrics.timed("products")
+def import_products(items, defaults=None):
+    """Adds or updates many products at once: items is a list of
+    (product_id or None, data), None meaning a new id. data is merged into an
+    existing product like update_product does; a new product is defaults
+    with data on top. Listeners get a single full-reload notification
+    instead of one per product.
+
+    Returns (added ids, updated ids).
+    """
+    global _version, _next_id
+    _ensure_loaded()
+    # Ids given in the batch are taken first, so a new book can't be handed
+    # one of them and then be overwritten by a later row
+    _next_id = max([_next_id] + [int(product_id) + 1 for product_id, _ in items if product_id is not None])
+    added, updated = [], []
+    for product_id, data in items:
+        if product_id is None:
+            product_id = _next_id
+        product_id = int(product_id)
+        if product_id in _catalog:
+            updated.append(product_id)
+            _catalog[product_id] = dict(_catalog[product_id], **data)
+        else:
+            added.append(product_id)
+            _catalog[product_id] = dict(defaults or {}, **data)
+        _next_id = max(_next_id, product_id + 1)
+    if added or updated:
+        _version += 1
+        _notify(None, None)
+    return added, updated
+
+def update_product(product_id, changes):
+    """Merges changes into a product; returns False if it doesn't exist."""
+    _ensure_loaded()
+    product = _catalog.get(int(product_id))
+    if product is None:
+        return False
+    set_product(product_id, dict(product, **changes))
+    return True
+
+if cluster.enabled():
+    # Multi-worker mode: changes are written through under the cluster lock,
+    # on top of other workers' changes, and announced to them
+    writer = cluster.SharedWriter(DB_FILE, take_snapshot, write_snapshot, reload_products)
+else:
+    writer = StoreWriter(DB_FILE, take_snapshot, write_snapshot)
+
+def _write_now():
+    snapshot = take_snapshot()
+    if snapshot is not None:
+        write_snapshot(snapshot)
+
 def save_product(product_id, data):
-    products = load_products()
-    products[product_id] = data
-    
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(products, f, indent=4, ensure_ascii=False)
+    set_product(product_id, data)
+    _write_now()
 
 def get_next_id():
-    products = load_products()
-    if not products:
-        return 1
-    return max(products.keys()) + 1
+    _ensure_loaded()
+    return _next_id
 
 def delete_product(product_id):
-    products = load_products()
-    if product_id in products:
-        del products[product_id]
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(products, f, indent=4, ensure_ascii=False)
-        return True
-    return False
+    if not remove_product(product_id):
+        return False
+    _write_now()
+    return True
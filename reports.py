@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import analytics
+import fileio
+import products
+
+# /stats reports are generated by analytics.export_stats in a separate
+# process. The result is cached under a key made from the event log
+# segments and products.json, so repeated requests are served from the
+# cached file until new events arrive or the catalog changes, and
+# concurrent requests for the same key share one in-flight job.
+REPORTS_DIR = "reports"
+
+_executor = None
+_cached = None
+_inflight = {}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the bot process has I/O threads and an open database
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _report_key():
+    parts = []
+    for path in analytics.segment_paths() + [products.DB_FILE]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def _generate(key):
+    global _cached
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, f"statistics-{key}.xlsx")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_executor(), analytics.export_stats, path)
+    if _cached is not None and _cached[1] != path:
+        await fileio.run(_remove, _cached[1])
+    _cached = (key, path)
+    return path
+
+async def get_stats_report():
+    """Returns the path of an up-to-date statistics.xlsx."""
+    # Buffered events belong in the report
+    await analytics.flush_async()
+    key = await fileio.run(_report_key)
+    if _cached is not None and _cached[0] == key and os.path.exists(_cached[1]):
+        return _cached[1]
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate(key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: one admin giving up must not cancel the job for the others
+    return await asyncio.shield(task)
+
+async def stop():
+    global _executor
+    if _executor is not None:
+        logging.info("Shutting down the report worker")
+        await fileio.run(_executor.shutdown)
+        _executor = None
@@ -0,0 +1,310 @@
+import bisect
+import re
+from collections import OrderedDict
+
+import products
+
+# Uzbek text uses several apostrophe look-alikes (o‘, oʻ, o’, o`, o').
+# They are all folded to a plain ASCII apostrophe before tokenizing.
+APOSTROPHES = "‘’ʻʼ`´"
+_APOSTROPHE_TABLE = str.maketrans({c: "'" for c in APOSTROPHES})
+_TOKEN_RE = re.compile(r"[\w']+")
+
+NAME_WEIGHT = 10
+DESCRIPTION_WEIGHT = 1
+PREFIX_FACTOR = 0.5
+# The last query word may still be being typed, so it also matches longer
+# words, the shortest MAX_EXPANSIONS of them; the other words match exactly
+MAX_EXPANSIONS = 20
+CACHE_SIZE = 256
+# Inline search-as-you-type indexes name word prefixes up to this length;
+# longer query words are looked up by their first MAX_PREFIX characters and
+# then checked against the full words.
+MAX_PREFIX = 12
+
+def normalize(text):
+    return (text or "").lower().translate(_APOSTROPHE_TABLE)
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(normalize(text)):
+        token = token.strip("'")
+        if token:
+            tokens.append(token)
+    return tokens
+
+class SearchIndex:
+    """Token inverted index over the catalog.
+
+    Every token maps to {product_id: weight}; name tokens weigh more than
+    description tokens. All query tokens must match: the last one by prefix,
+    the others exactly. Results are ranked by the summed weight.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.postings = {}
+        self.doc_tokens = {}
+        self.names = {}
+        self.version = 0
+        self._vocab = []
+        self._vocab_dirty = False
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def build(self, catalog):
+        self.postings = {}
+        self.doc_tokens = {}
+        self.names = {}
+        for pid, product in catalog.items():
+            self._add(pid, product)
+        self._changed()
+
+    def add(self, pid, product):
+        self._remove(pid)
+        self._add(pid, product)
+        self._changed()
+
+    def remove(self, pid):
+        self._remove(pid)
+        self._changed()
+
+    def _add(self, pid, product):
+        weights = {}
+        for token in tokenize(product.get("description", "")):
+            weights[token] = DESCRIPTION_WEIGHT
+        for token in tokenize(product.get("name", "")):
+            weights[token] = weights.get(token, 0) + NAME_WEIGHT
+        for token, weight in weights.items():
+            self.postings.setdefault(token, {})[pid] = weight
+        self.doc_tokens[pid] = list(weights)
+        self.names[pid] = normalize(product.get("name", ""))
+
+    def _remove(self, pid):
+        for token in self.doc_tokens.pop(pid, ()):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(pid, None)
+            if not posting:
+                del self.postings[token]
+        self.names.pop(pid, None)
+
+    def _changed(self):
+        self.version += 1
+        self._vocab_dirty = True
+        self._cache.clear()
+
+    def _matching_tokens(self, prefix):
+        # The exact token and the shortest MAX_EXPANSIONS longer ones
+        if self._vocab_dirty:
+            self._vocab = sorted(self.postings)
+            self._vocab_dirty = False
+        tokens = []
+        start = bisect.bisect_left(self._vocab, prefix)
+        for i in range(start, len(self._vocab)):
+            token = self._vocab[i]
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+        if len(tokens) > MAX_EXPANSIONS:
+            tokens = sorted(tokens, key=len)[:MAX_EXPANSIONS]
+        return tokens
+
+    def _score_token(self, query_token, prefix, candidates):
+        # Scores of the products matching query_token; with candidates (the
+        # products matching the earlier tokens) only those are looked at,
+        # walking whichever side is smaller
+        scores = {}
+        tokens = self._matching_tokens(query_token) if prefix else [query_token]
+        for token in tokens:
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            factor = 1 if token == query_token else PREFIX_FACTOR
+            if candidates is not None and len(candidates) < len(posting):
+                matches = ((pid, posting[pid]) for pid in candidates if pid in posting)
+            elif candidates is not None:
+                matches = ((pid, weight) for pid, weight in posting.items() if pid in candidates)
+            else:
+                matches = posting.items()
+            for pid, weight in matches:
+                score = weight * factor
+                if score > scores.get(pid, 0):
+                    scores[pid] = score
+        return scores
+
+    def search(self, query):
+        """Returns product ids ranked best first."""
+        key = (self.version, normalize(query).strip())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        query_tokens = tokenize(query)
+        # Exact words first, rarest first, so every later word only has to
+        # look at the products that are still in
+        steps = []
+        if query_tokens:
+            last = query_tokens[-1]
+            exact = set(query_tokens[:-1]) - {last}
+            steps = [(token, False) for token in sorted(exact, key=lambda token: len(self.postings.get(token, ())))]
+            steps.append((last, True))
+        totals = None
+        for query_token, prefix in steps:
+            scores = self._score_token(query_token, prefix, totals)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {pid: totals[pid] + s for pid, s in scores.items()}
+            if not totals:
+                break
+
+        results = []
+        if totals:
+            phrase = key[1]
+            for pid in totals:
+                # Whole query found in the name (e.g. a full title) ranks first.
+                if phrase and phrase in self.names.get(pid, ""):
+                    totals[pid] += NAME_WEIGHT * len(query_tokens)
+            # Best score first, lower id first among equals (the sort is stable)
+            results = sorted(sorted(totals), key=totals.__getitem__, reverse=True)
+
+        self._cache[key] = results
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return results
+
+class PrefixIndex:
+    """Prefix index over product names, for inline search-as-you-type.
+
+    Every prefix (up to MAX_PREFIX characters) of every normalized name word
+    maps to the set of products having such a word, so a keystroke costs one
+    dictionary lookup per query word. Results are ordered with titles that
+    start with the query first, then by name, and kept in an LRU cache per
+    normalized query until the catalog changes.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.prefixes = {}
+        self.words = {}
+        self.names = {}
+        self.version = 0
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def build(self, catalog):
+        self.prefixes = {}
+        self.words = {}
+        self.names = {}
+        for pid, product in catalog.items():
+            self._add(pid, product)
+        self._changed()
+
+    def add(self, pid, product):
+        self._remove(pid)
+        self._add(pid, product)
+        self._changed()
+
+    def remove(self, pid):
+        self._remove(pid)
+        self._changed()
+
+    def _add(self, pid, product):
+        words = set(tokenize(product.get("name", "")))
+        for word in words:
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self.prefixes.setdefault(word[:length], set()).add(pid)
+        self.words[pid] = words
+        self.names[pid] = normalize(product.get("name", ""))
+
+    def _remove(self, pid):
+        for word in self.words.pop(pid, ()):
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                posting = self.prefixes.get(word[:length])
+                if posting is None:
+                    continue
+                posting.discard(pid)
+                if not posting:
+                    del self.prefixes[word[:length]]
+        self.names.pop(pid, None)
+
+    def _changed(self):
+        self.version += 1
+        self._cache.clear()
+
+    def _lookup(self, word):
+        matches = self.prefixes.get(word[:MAX_PREFIX], set())
+        if len(word) > MAX_PREFIX:
+            matches = {pid for pid in matches if any(w.startswith(word) for w in self.words[pid])}
+        return matches
+
+    def suggest(self, query):
+        """Returns product ids whose name words start with the query words."""
+        phrase = " ".join(tokenize(query))
+        results = self._cache.get(phrase)
+        if results is not None:
+            self._cache.move_to_end(phrase)
+            return results
+
+        if not phrase:
+            # Empty query: the newest books first
+            results = sorted(self.names, reverse=True)
+        else:
+            matches = None
+            for word in sorted(phrase.split(), key=len, reverse=True):
+                found = self._lookup(word)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    break
+            results = sorted(matches or (), key=lambda pid: (not self.names[pid].startswith(phrase), self.names[pid], pid))
+
+        self._cache[phrase] = results
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return results
+
+_index = SearchIndex()
+_index_ready = False
+_prefix_index = PrefixIndex()
+_prefix_index_ready = False
+
+def _on_catalog_change(product_id, product):
+    global _index_ready, _prefix_index_ready
+    if product_id is None:
+        # Full reload of the catalog, rebuild on next search.
+        _index_ready = _prefix_index_ready = False
+        return
+    for index, ready in ((_index, _index_ready), (_prefix_index, _prefix_index_ready)):
+        if not ready:
+            continue
+        if product is None:
+            index.remove(product_id)
+        else:
+            index.add(product_id, product)
+
+products.add_listener(_on_catalog_change)
+
+def get_index():
+    global _index_ready
+    catalog = products.load_products()
+    if not _index_ready:
+        _index.build(catalog)
+        _index_ready = True
+    return _index
+
+def get_prefix_index():
+    global _prefix_index_ready
+    catalog = products.load_products()
+    if not _prefix_index_ready:
+        _prefix_index.build(catalog)
+        _prefix_index_ready = True
+    return _prefix_index
+
+def suggest_products(query):
+    return get_prefix_index().suggest(query)
+
+def search_products(query, limit=None):
+    results = get_index().search(query)
+    if limit is not None:
+        return results[:limit]
+    return results
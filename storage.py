@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+import cart_db
+import fileio
+import metrics
+import orders_db
+import products
+import users_db
+
+# Async facade over the stores for the handlers. Reads served from memory
+# stay synchronous (products.load_products/get_product); everything that
+# touches the disk or the database is awaited on the fileio pool so a slow
+# write never stalls other users' updates.
+
+# Catalog and user registry changes go through their store's single writer:
+# the cache (and the search/keyboard indexes) change on the loop, and a burst
+# of changes is written to the file once. durable=True waits for that write,
+# used for admin edits so "saved" means on disk.
+
+async def save_product(product_id, data):
+    await products.writer.apply(products.set_product, product_id, data, durable=True)
+
+async def add_product(data):
+    # Picking the id and storing the product is one unit of work, so two
+    # admins adding books at once can't get the same id
+    return await products.writer.apply(products.add_product, data, durable=True)
+
+async def update_product(product_id, changes):
+    return await products.writer.apply(products.update_product, product_id, changes, durable=True)
+
+async def import_products(items, defaults=None):
+    # The whole batch is one unit of work: one file write, one index rebuild
+    return await products.writer.apply(products.import_products, items, defaults, durable=True)
+
+async def delete_product(product_id):
+    return await products.writer.apply(products.remove_product, product_id, durable=True)
+
+def _catalog_args():
+    # Prices for the cart subtotals. Looked up here on the loop: a reload of
+    # the catalog notifies the search/keyboard indexes and must not happen
+    # on the pool. The stamp is taken first, so it is never newer than the
+    # prices the pool reads; at worst a subtotal is recomputed once more.
+    stamp = products.get_stamp()
+    return {"catalog": products.load_products(), "stamp": stamp}
+
+async def add_to_cart(user_id, product_id, quantity=1):
+    return await fileio.run(cart_db.add_to_cart, user_id, product_id, quantity, **_catalog_args())
+
+async def get_cart(user_id):
+    return await fileio.run(cart_db.get_cart, user_id, **_catalog_args())
+
+async def remove_from_cart(user_id, product_id):
+    return await fileio.run(cart_db.remove_from_cart, user_id, product_id, **_catalog_args())
+
+async def clear_cart(user_id):
+    await fileio.run(cart_db.clear_cart, user_id)
+
+async def replace_cart(user_id, items):
+    return await fileio.run(cart_db.replace_cart, user_id, items, **_catalog_args())
+
+async def add_user(user_id):
+    return await users_db.writer.apply(users_db.register, user_id)
+
+async def create_order(order_id, user_id, items, shipping_name, shipping_price, phone, address):
+    return await fileio.run(orders_db.create_order, order_id, user_id, items, shipping_name, shipping_price, phone, address)
+
+async def get_order(order_id):
+    return await fileio.run(orders_db.get_order, order_id)
+
+async def get_user_orders(user_id, limit=10):
+    return await fileio.run(orders_db.get_user_orders, user_id, limit)
+
+async def set_order_status(order_id, new_status, expected_status=orders_db.STATUS_NEW):
+    return await fileio.run(orders_db.set_status, order_id, new_status, expected_status)
+
+# --- Event loop lag monitor ---
+# A task that should wake up every LAG_CHECK_INTERVAL seconds; any extra
+# delay is time the loop was blocked by synchronous work.
+LAG_CHECK_INTERVAL = 0.1
+LAG_WARNING = 0.1
+
+loop_stats = {"checks": 0, "blocked_total": 0.0, "blocked_max": 0.0, "slow_checks": 0}
+_monitor_task = None
+
+metrics.gauge("bot_event_loop_blocked_seconds", "Total time the event loop was blocked.",
+              lambda: loop_stats["blocked_total"])
+metrics.gauge("bot_event_loop_blocked_max_seconds", "Longest single event loop block.",
+              lambda: loop_stats["blocked_max"])
+
+async def _monitor_loop():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_CHECK_INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - LAG_CHECK_INTERVAL)
+        loop_stats["checks"] += 1
+        loop_stats["blocked_total"] += lag
+        loop_stats["blocked_max"] = max(loop_stats["blocked_max"], lag)
+        if lag >= LAG_WARNING:
+            loop_stats["slow_checks"] += 1
+            logging.warning("Event loop was blocked for %.3f s", lag)
+
+async def start_monitor():
+    global _monitor_task
+    _monitor_task = asyncio.create_task(_monitor_loop())
+
+async def stop_monitor():
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        try:
+            await _monitor_task
+        except asyncio.CancelledError:
+            pass
+        _monitor_task = None
+    logging.info("Event loop blocked %.3f s in total (max %.3f s, %d slow checks)",
+                 loop_stats["blocked_total"], loop_stats["blocked_max"], loop_stats["slow_checks"])
@@ -0,0 +1,123 @@
+import asyncio
+import contextlib
+import logging
+import fileio
+
+# Single writer for a file-backed store. Changes are sent to it as messages
+# (a function to run against the store's in-memory state) and applied one at
+# a time on the event loop, so a multi-step change can't interleave with
+# another writer. The file is written once per burst of changes: FLUSH_DELAY
+# after the last one, but no later than MAX_FLUSH_DELAY after the first
+# unflushed one. The snapshot is taken on the loop, the write runs on the
+# fileio pool, and stop() flushes whatever is left.
+FLUSH_DELAY = 0.5
+MAX_FLUSH_DELAY = 2.0
+
+class StoreWriter:
+    def __init__(self, name, snapshot, write, delay=FLUSH_DELAY, max_delay=MAX_FLUSH_DELAY, lock=None):
+        # snapshot() returns the data to persist, or None if nothing changed;
+        # write(data) is blocking and persists it. If write() raises, the
+        # store must hand the same data to the next snapshot(), which the
+        # retry writes. lock() is an async context manager held around each
+        # flush (e.g. cluster.lock).
+        self.name = name
+        self._snapshot = snapshot
+        self._write = write
+        self._lock = lock or contextlib.nullcontext
+        self.delay = delay
+        self.max_delay = max_delay
+        self.flushes = 0
+        self._queue = None
+        self._task = None
+        self._first_change = None
+        self._last_change = None
+        self._durable = []
+
+    def is_running(self):
+        return self._task is not None
+
+    async def apply(self, func, *args, durable=False):
+        """Runs func(*args) as one unit of work and returns its result.
+
+        func is synchronous and may make any number of changes; they are
+        applied together and persisted by the same flush. With durable=True
+        this returns only once that flush is on disk.
+        """
+        if self._task is None:
+            # Not started (scripts): apply and write right away
+            result = func(*args)
+            await self.flush_now()
+            return result
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((func, args, future, durable))
+        return await future
+
+    async def flush_now(self):
+        async with self._lock():
+            data = self._snapshot()
+            if data is not None:
+                await fileio.run(self._write, data)
+                self.flushes += 1
+
+    async def _flush(self):
+        self._first_change = self._last_change = None
+        waiters, self._durable = self._durable, []
+        error = None
+        try:
+            await self.flush_now()
+        except Exception as e:
+            logging.exception("Writing %s failed, will retry", self.name)
+            error = e
+            # Still unflushed, try again after the next delay
+            self._first_change = self._last_change = asyncio.get_running_loop().time()
+        for future, result in waiters:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _timeout(self):
+        if self._first_change is None:
+            return None
+        deadline = min(self._last_change + self.delay, self._first_change + self.max_delay)
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+
+    async def _run(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self._queue.get(), self._timeout())
+            except asyncio.TimeoutError:
+                await self._flush()
+                continue
+            if message is None:
+                await self._flush()
+                return
+            func, args, future, durable = message
+            try:
+                result = func(*args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            now = asyncio.get_running_loop().time()
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+            if durable:
+                self._durable.append((future, result))
+            elif not future.done():
+                future.set_result(result)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Changes queued before the stop are applied and flushed first
+        await self._queue.put(None)
+        await self._task
+        self._task = None
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import catalog_io
+import products
+
+
+class ImportProductsTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        products.reload_products()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        products.reload_products()
+
+    def book(self, name, price):
+        return {"name": name, "category": "Boshqa", "price": price, "description": "", "image": ""}
+
+    def test_new_row_does_not_take_an_id_given_later_in_the_batch(self):
+        for product_id in range(1, 10):
+            products.set_product(product_id, self.book(f"Kitob {product_id}", 1000))
+        self.assertEqual(products.get_next_id(), 10)
+
+        added, updated = products.import_products([
+            (None, self.book("New A", 100)),
+            (10, self.book("Publisher B", 200)),
+        ])
+
+        self.assertEqual(updated, [])
+        self.assertEqual(sorted(added), [10, 11])
+        self.assertEqual(products.get_product(10)["name"], "Publisher B")
+        self.assertEqual(products.get_product(11)["name"], "New A")
+        self.assertEqual(products.get_next_id(), 12)
+
+    def test_update_keeps_columns_missing_from_the_file(self):
+        products.set_product(1, {"name": "Kitob", "category": "Roman", "price": 1000,
+                                 "description": "Tavsif", "image": "images/1.jpg"})
+        with open("narxlar.csv", "w", encoding="utf-8") as f:
+            f.write("id,name,price\n1,Kitob,1500\n,Yangi kitob,2000\n")
+
+        result = catalog_io.read_catalog_file("narxlar.csv")
+        added, updated = products.import_products(result.products, catalog_io.NEW_PRODUCT)
+
+        self.assertEqual((added, updated), ([2], [1]))
+        self.assertEqual(products.get_product(1), {"name": "Kitob", "category": "Roman", "price": 1500,
+                                                   "description": "Tavsif", "image": "images/1.jpg"})
+        self.assertEqual(products.get_product(2), dict(catalog_io.NEW_PRODUCT, name="Yangi kitob", price=2000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import logging
+import time
+from collections import OrderedDict
+
+import config
+import metrics
+
+# Per-user flood protection. Every handler belongs to a class (cart, search,
+# browse, ...) and each (user, class) pair has a token bucket: `burst` taps
+# in a row are fine, then `rate` per second. A throttled button press is
+# answered with a short notice instead of being processed; a throttled
+# message gets the notice once and is dropped. Admins are never throttled.
+# Buckets live in a bounded LRU, so a flood of new user ids can't grow it
+# without limit; an evicted bucket was idle and would be full anyway.
+MAX_BUCKETS = 100000
+
+# class: (rate per second, burst)
+LIMITS = {
+    "cart": (2, 8),
+    "search": (1, 5),
+    "inline": (5, 20),
+    "browse": (3, 12),
+    "default": (2, 10),
+}
+
+HANDLER_CLASSES = {
+    "add_item_to_cart": "cart",
+    "change_cart_quantity": "cart",
+    "process_clear_cart": "cart",
+    "start_buy_process": "cart",
+    "process_search": "search",
+    "show_search_page": "search",
+    "inline_search": "inline",
+    "show_categories": "browse",
+    "show_books_in_category": "browse",
+    "show_category_page": "browse",
+    "back_to_cats": "browse",
+    "show_product_detail": "browse",
+    "back_to_list": "browse",
+    "show_all_products_page": "browse",
+    "show_cart": "browse",
+    "show_my_orders": "browse",
+}
+
+THROTTLE_NOTICE = "⏳ Juda tez! Iltimos, biroz kuting."
+
+THROTTLED = "bot_throttled_total"
+metrics.describe(THROTTLED, "counter", "Updates dropped by the per-user throttle, by handler class and handler.")
+
+_buckets = OrderedDict()
+_enabled = True
+
+metrics.gauge("bot_throttle_buckets", "Token buckets held by the throttle.", lambda: len(_buckets))
+
+def parse_limits(text):
+    """Reads "cart=2/8,search=1/5" (rate per second / burst) into LIMITS."""
+    limits = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        try:
+            name, value = item.split("=")
+            rate, burst = value.split("/")
+            limits[name.strip()] = (float(rate), float(burst))
+        except ValueError:
+            logging.warning("Ignoring bad THROTTLE_LIMITS entry %r", item)
+    return limits
+
+def configure(text):
+    global _enabled
+    _enabled = text.strip().lower() not in ("0", "off")
+    if _enabled:
+        LIMITS.update(parse_limits(text))
+    _buckets.clear()
+
+def allow(user_id, handler_class, now=None):
+    """Takes a token from the user's bucket; returns (allowed, first refusal in a row)."""
+    rate, burst = LIMITS.get(handler_class, LIMITS["default"])
+    if now is None:
+        now = time.monotonic()
+    key = (user_id, handler_class)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        # [tokens, last refill, already notified]
+        bucket = _buckets[key] = [burst, now, False]
+        if len(_buckets) > MAX_BUCKETS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(key)
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        bucket[2] = False
+        return True, False
+    first = not bucket[2]
+    bucket[2] = True
+    return False, first
+
+async def throttle_middleware(handler, event, data):
+    # Inner middleware: the handler is known, so its class is too
+    user = data.get("event_from_user")
+    if not _enabled or user is None or str(user.id) in config.ADMIN_IDS:
+        return await handler(event, data)
+    name = data["handler"].callback.__name__
+    handler_class = HANDLER_CLASSES.get(name, "default")
+    allowed, first = allow(user.id, handler_class)
+    if allowed:
+        return await handler(event, data)
+
+    metrics.inc(THROTTLED, handler_class=handler_class, handler=name)
+    event_type = type(event).__name__
+    if event_type == "CallbackQuery":
+        # Has to be answered anyway, or the button keeps spinning
+        await event.answer(THROTTLE_NOTICE)
+    elif event_type == "Message" and first:
+        await event.answer(THROTTLE_NOTICE)
+    # Inline queries are just not answered; Telegram drops them
+    return None
+
+def install(*routers):
+    configure(config.THROTTLE_LIMITS)
+    for router in routers:
+        for observer in (router.message, router.callback_query, router.inline_query):
+            observer.middleware(throttle_middleware)
@@ -1,25 +1,321 @@
+import asyncio
 import json
+import logging
 import os
+import threading
+from datetime import datetime
+import cluster
+import fileio
+import metrics
+from store_writer import StoreWriter
 
 DB_FILE = "users.json"
+LOG_FILE = "users.log"
+BLOCKED_FILE = "blocked_users.json"
+COMPACT_INTERVAL = 600
+# Users copied or merged per lock hold (compact, merge)
+COMPACT_CHUNK = 5000
 
+# The registry is loaded once into memory. users.json is a snapshot and
+# every change after it is appended as one JSON line to users.log, so
+# /start never rewrites the whole file. compact() folds the log back into
+# the snapshot; it runs periodically from start() and once on stop().
+# In the bot, changes go through `writer`: they are applied in memory and
+# queued in _unflushed, and a burst of them is appended to the log in one
+# write (see store_writer.py). A crash loses at most the last FLUSH_DELAY.
+#
+# _users maps user_id -> {"first_seen", "last_seen", "blocked"} and _order
+# keeps ids in registration order. _order only ever grows, so iterating it
+# by position is safe while new users are being added.
+#
+# In multi-worker mode (cluster.py) every worker appends to the same log
+# under the cluster lock. Only the primary compacts: under the lock it first
+# merges the other workers' records (refresh), which appends their new users
+# at the end of _order, so positions stay stable.
+_users = {}
+_order = []
+_loaded = False
+_dirty = False
+_unflushed = []
+_lock = threading.Lock()
+_compact_task = None
+
+def _timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _apply(record, users=None, order=None):
+    # Into the registry, or into users/order being read from the files
+    if users is None:
+        users, order = _users, _order
+    user_id = record["id"]
+    user = users.get(user_id)
+    if user is None:
+        user = {"first_seen": None, "last_seen": None, "blocked": False}
+        users[user_id] = user
+        order.append(user_id)
+    for key in ("first_seen", "last_seen", "blocked"):
+        if key in record:
+            user[key] = record[key]
+
+def _replay_log(path, users, order):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                _apply(json.loads(line), users, order)
+            except (json.JSONDecodeError, KeyError):
+                # Torn last line after a crash
+                continue
+
+def _read_files():
+    """Parses users.json and the logs; returns (users, order, had old
+    blocked file). Touches no shared state, so it needs no lock."""
+    users, order = {}, []
+    blocked_file = False
+    if os.path.exists(DB_FILE):
+        with open(DB_FILE, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                data = []
+        if isinstance(data, list):
+            # Old format: a plain list of ids
+            for user_id in data:
+                _apply({"id": user_id}, users, order)
+        else:
+            for user_id, user in data.items():
+                _apply(dict(user, id=int(user_id)), users, order)
+    # Blocked users recorded before the registry had a blocked flag
+    if os.path.exists(BLOCKED_FILE):
+        with open(BLOCKED_FILE, "r", encoding="utf-8") as f:
+            try:
+                for user_id in json.load(f):
+                    _apply({"id": user_id, "blocked": True}, users, order)
+                blocked_file = True
+            except json.JSONDecodeError:
+                pass
+    # A compaction interrupted by a crash leaves its rotated log behind
+    _replay_log(LOG_FILE + ".old", users, order)
+    _replay_log(LOG_FILE, users, order)
+    return users, order, blocked_file
+
+def _ensure_loaded():
+    global _users, _order, _loaded, _dirty
+    if _loaded:
+        return
+    _users, _order, blocked_file = _read_files()
+    _dirty = _dirty or blocked_file
+    _loaded = True
+
+def _append(records):
+    global _dirty
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+    _dirty = True
+
+@metrics.timed("users")
 def load_users():
-    if not os.path.exists(DB_FILE):
-        return []
-    with open(DB_FILE, "r", encoding="utf-8") as f:
+    with _lock:
+        _ensure_loaded()
+        return list(_order)
+
+def register(user_id):
+    """Registers a /start in memory. Returns True if the user is new."""
+    now = _timestamp()
+    with _lock:
+        _ensure_loaded()
+        is_new = user_id not in _users
+        record = {"id": user_id, "last_seen": now}
+        if is_new:
+            record["first_seen"] = now
+        # A user who pressed /start again has unblocked the bot
+        if not is_new and _users[user_id]["blocked"]:
+            record["blocked"] = False
+        _apply(record)
+        _unflushed.append(record)
+    return is_new
+
+def block(user_ids):
+    with _lock:
+        _ensure_loaded()
+        for user_id in user_ids:
+            if user_id in _users and not _users[user_id]["blocked"]:
+                record = {"id": user_id, "blocked": True}
+                _apply(record)
+                _unflushed.append(record)
+
+def take_unflushed():
+    """Records not yet in the log, or None."""
+    global _unflushed
+    with _lock:
+        records, _unflushed = _unflushed, []
+    return records or None
+
+@metrics.timed("users")
+def append_records(records):
+    global _unflushed
+    with _lock:
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+            _append(records)
+        except OSError:
+            # Back in the queue, ahead of newer ones, so the writer's retry
+            # has them to write
+            _unflushed = records + _unflushed
+            raise
+
+writer = StoreWriter(LOG_FILE, take_unflushed, append_records, lock=cluster.lock)
 
+def _write_now():
+    records = take_unflushed()
+    if records:
+        append_records(records)
+
+@metrics.timed("users")
 def add_user(user_id):
-    users = load_users()
-    if user_id not in users:
-        users.append(user_id)
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(users, f, indent=4)
-        return True
-    return False
+    """Registers a /start and writes it right away. Returns True if the user is new."""
+    is_new = register(user_id)
+    _write_now()
+    return is_new
+
+@metrics.timed("users")
+def mark_blocked(user_ids):
+    block(user_ids)
+    _write_now()
+
+def get_user(user_id):
+    with _lock:
+        _ensure_loaded()
+        user = _users.get(user_id)
+        return dict(user) if user else None
+
+def count_users():
+    with _lock:
+        _ensure_loaded()
+        return len(_order)
+
+def iter_users(start=0, stop=None, include_blocked=False):
+    """Lazily yields (position, user_id) in registration order.
+
+    Positions are stable, so a broadcast can remember where it stopped and
+    continue from there.
+    """
+    with _lock:
+        _ensure_loaded()
+    position = start
+    while position < (len(_order) if stop is None else min(stop, len(_order))):
+        user_id = _order[position]
+        if include_blocked or not _users[user_id]["blocked"]:
+            yield position, user_id
+        position += 1
 
 def get_all_users():
-    return load_users()
+    # Lazy, so a broadcast doesn't materialize the whole list
+    for _, user_id in iter_users(include_blocked=True):
+        yield user_id
+
+@metrics.timed("users")
+def merge():
+    """Picks up the records other workers appended to the log. Call it
+    holding the cluster lock, so our own flushes can't interleave.
+
+    The files are parsed with no lock held; only the users that differ are
+    applied, a chunk at a time, so register() on the loop never waits for
+    the whole registry. Our unflushed changes go back on top.
+    """
+    with _lock:
+        _ensure_loaded()
+    users, order, _ = _read_files()
+    for start in range(0, len(order), COMPACT_CHUNK):
+        with _lock:
+            for user_id in order[start:start + COMPACT_CHUNK]:
+                user = users[user_id]
+                if _users.get(user_id) != user:
+                    _apply(dict(user, id=user_id))
+    with _lock:
+        for record in _unflushed:
+            _apply(record)
+
+async def refresh():
+    """Multi-worker mode: picks up users registered by the other workers."""
+    if cluster.enabled():
+        async with cluster.lock():
+            await fileio.run(merge)
+
+@metrics.timed("users")
+def compact(shared=False):
+    """Folds users.log into the users.json snapshot.
+
+    shared: other workers append to the log too (cluster.py); merge their
+    records first. Call it holding the cluster lock.
+    """
+    global _dirty
+    if shared:
+        merge()
+    with _lock:
+        if shared:
+            _dirty = _dirty or os.path.exists(LOG_FILE)
+        _ensure_loaded()
+        if not _dirty:
+            return
+        # New appends go to a fresh log while the snapshot is written
+        if os.path.exists(LOG_FILE):
+            if os.path.exists(LOG_FILE + ".old"):
+                # Left over from a failed compaction, keep both logs
+                with open(LOG_FILE, "r", encoding="utf-8") as src, open(LOG_FILE + ".old", "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(LOG_FILE)
+            else:
+                os.replace(LOG_FILE, LOG_FILE + ".old")
+        _dirty = False
+        count = len(_order)
+    # The snapshot is copied a chunk at a time and serialized without the
+    # lock, so register() on the event loop never waits for a big registry.
+    # Changes made meanwhile may or may not make it into the copy; they are
+    # in the new log either way and replaying them again is harmless.
+    users = {}
+    for start in range(0, count, COMPACT_CHUNK):
+        with _lock:
+            for user_id in _order[start:start + COMPACT_CHUNK]:
+                users[str(user_id)] = dict(_users[user_id])
+    try:
+        fileio.atomic_write_text(DB_FILE, json.dumps(users, indent=4))
+    except OSError:
+        _dirty = True
+        raise
+    for path in (LOG_FILE + ".old", BLOCKED_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+
+async def compact_async():
+    async with cluster.lock():
+        await fileio.run(compact, cluster.enabled())
+
+async def _compact_loop():
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        try:
+            await compact_async()
+        except Exception:
+            logging.exception("Users compaction failed")
+
+async def start():
+    global _compact_task
+    await fileio.run(load_users)
+    await writer.start()
+    if cluster.is_primary():
+        _compact_task = asyncio.create_task(_compact_loop())
+
+async def stop():
+    global _compact_task
+    if _compact_task is not None:
+        _compact_task.cancel()
+        try:
+            await _compact_task
+        except asyncio.CancelledError:
+            pass
+        _compact_task = None
+    # Queued registrations reach the log before it is folded into users.json
+    await writer.stop()
+    if cluster.is_primary():
+        await compact_async()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import secrets
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+import config
+
+# Webhook serving mode (BOT_MODE=webhook). Telegram POSTs updates to an
+# aiohttp app; each request is checked against the secret token and its
+# update is put on a bounded queue that a fixed number of workers feed to
+# the dispatcher. On shutdown the server stops accepting updates and the
+# queue is drained before the dispatcher's shutdown hooks run. Only public
+# aiogram API is used (Dispatcher.feed_raw_update, setup_application), so an
+# aiogram upgrade can't change how requests are handled.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WORKERS = 16
+QUEUE_SIZE = 256
+QUEUE_PUT_TIMEOUT = 5
+DRAIN_TIMEOUT = 30
+
+class QueuedRequestHandler:
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token=None,
+                 workers=WORKERS, queue_size=QUEUE_SIZE, **data):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.data = data
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._accepting = False
+
+    async def start(self, *args, **kwargs):
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update, **self.data)
+            except Exception:
+                logging.exception("Update processing failed")
+            finally:
+                self.queue.task_done()
+
+    def _verify_secret(self, request: web.Request):
+        if not self.secret_token:
+            return True
+        return secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token)
+
+    async def handle(self, request: web.Request):
+        if not self._verify_secret(request):
+            return web.Response(status=401, text="Unauthorized")
+        if not self._accepting:
+            return web.Response(status=503, text="Shutting down")
+        update = await request.json(loads=self.bot.session.json_loads)
+        try:
+            # A full queue holds the request; Telegram retries on 503
+            await asyncio.wait_for(self.queue.put(update), timeout=QUEUE_PUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Update queue full, asking Telegram to retry")
+            return web.Response(status=503, text="Busy")
+        return web.json_response({}, dumps=self.bot.session.json_dumps)
+
+    async def drain(self, *args, **kwargs):
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Shutdown with %d updates still queued", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def close_session(self, *args, **kwargs):
+        await self.bot.session.close()
+
+def create_app(dp: Dispatcher, bot: Bot, secret_token=None, path=None):
+    """Builds the aiohttp app; returns (app, handler)."""
+    app = web.Application()
+    handler = QueuedRequestHandler(dp, bot, secret_token=secret_token)
+    app.router.add_route("POST", path or config.WEBHOOK_PATH, handler.handle)
+    # Order matters: workers start before updates arrive, and on shutdown
+    # the queue drains before the dispatcher's shutdown hooks close the stores.
+    app.on_startup.append(handler.start)
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dp, bot=bot)
+    app.on_shutdown.append(handler.close_session)
+    return app, handler
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    secret_token = config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app, _ = create_app(dp, bot, secret_token=secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    try:
+        await bot.set_webhook(
+            url=config.WEBHOOK_BASE_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info("Webhook server listening on %s:%s", config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()